@@ -16,7 +16,7 @@ from flask_apscheduler import APScheduler
 import config
 from models import db
 from views.admin import admin
-from services.translator import get_translated
+from services.translator import get_translated, get_translated_all
 
 app = Flask(config.APP_NAME)
 app.config.from_object(config)
@@ -122,14 +122,26 @@ def number_color(context, value):
 
 
 # custom template context
-def translate_name(text):
-    @cache.memoize(timeout=24 * 60 * 60)
-    def _translate(_text, lang):
-        return get_translated(_text, lang)
+@cache.memoize(timeout=24 * 60 * 60)
+def _translate(text, lang):
+    return get_translated(text, lang)
+
 
+def translate_name(text):
     return _translate(text, g.get('lang', app.config['BABEL_DEFAULT_LOCALE']))
 
 
+def forget_translations():
+    """Drops memoized translations, so new ones are used."""
+    cache.delete_memoized(_translate)
+
+
+def translate_names(texts):
+    """Translations of many names with one query, `{name: translated}`."""
+    return get_translated_all(texts, g.get('lang', app.config[
+        'BABEL_DEFAULT_LOCALE']))
+
+
 def translate_array(arr):
     return [translate_name(_(x)) for x in arr]
 
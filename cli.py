@@ -6,7 +6,8 @@ import logging
 from app import app, db
 import models
 import config
-from services import parser, rating_update, statistics, translator, games_chain
+from services import (parser, rating_update, statistics, translator,
+                      games_chain, benchmark, crawler, cache_warming)
 from flask.cli import with_appcontext
 from flask_migrate import Migrate
 
@@ -25,15 +26,27 @@ def parse_world():
 
 
 @app.cli.command(help='Runs parsing world rating for all months.')
+@click.option('--start-year', default=None, type=int)
 @with_appcontext
-def parse_world_all():
-    parser.parse_world_rating_all()
+def parse_world_all(start_year):
+    parser.parse_world_rating_all(start_year)
 
 
 @app.cli.command(help='Runs parsing UA rating for last month.')
+@click.option('--record', default=None,
+              help='Saves fetched pages to http fixtures archive.')
 @with_appcontext
-def parse_ua():
-    parser.parse_ua()
+def parse_ua(record):
+    if record:
+        app.config.update(PARSER_FIXTURES=record,
+                          PARSER_FIXTURES_MODE='record')
+        crawler.reset_crawler()
+    try:
+        parser.parse_ua()
+    finally:
+        if record:
+            # saves the archive
+            crawler.reset_crawler()
     update_statistics()
 
 
@@ -43,10 +56,21 @@ def update_ua_rating():
     rating_update.update_ua()
 
 
-@app.cli.command(help='Runs parsing UA rating for all months.')
+@app.cli.command(help='Runs parsing UA rating for all months. Resumes from '
+                      'rating lists not completed by previous runs.')
+@click.option('--workers', default=None, type=int)
+@click.option('--restart', is_flag=True, help='Ignores previous progress.')
 @with_appcontext
-def parse_ua_all():
-    parser.parse_ua_all()
+def parse_ua_all(workers, restart):
+    parser.parse_ua_all(workers=workers, resume=not restart)
+
+
+@app.cli.command(help='Resolves missing opponents of games, games parsed '
+                      'without opponent link are matched by unique name.')
+@with_appcontext
+def repair_opponents():
+    parser.repair_opponents()
+    games_chain.update_graphs(full=True)
 
 
 @app.cli.command(help='Looks for new names in DB and create '
@@ -70,14 +94,15 @@ def translate_names(group, lang):
             groups[group]()
 
 
-@app.cli.command(help='Updates rating statistics.')
+@app.cli.command(help='Updates rating statistics of changed data.')
+@click.option('--workers', type=int, help='Topics calculated in parallel.')
+@click.option('--full', is_flag=True,
+              help='Recalculates all topics, even if data did not change.')
 @with_appcontext
-def update_statistics():
-    app.logger.info('Deleting old statistics...')
-    models.TopicIssue.query.delete()
+def update_statistics(workers=None, full=False):
     app.logger.info('Creating topics...')
     statistics.create_default_topics()
-    statistics.calculate()
+    statistics.calculate(workers, full)
     app.logger.info('Running translation update...')
     translator.translate_statistics_topics('ru')
     translator.translate_statistics_topics('uk')
@@ -90,16 +115,109 @@ def create_default_topics():
 
 
 @app.cli.command(help='Updates players statistics.')
+@click.option('--all', 'update_all', is_flag=True,
+              help='Recounts all players, not only of the current list.')
 @with_appcontext
-def update_players_stat():
+def update_players_stat(update_all):
     app.logger.info('Updating players statistics')
-    rating_update.update_player_stats()
+    rating_update.update_player_stats(update_all=update_all)
 
 
 @app.cli.command(help='Updates (or create) player games graph.')
+@click.option('--full', is_flag=True, help='Recounts all games.')
+@with_appcontext
+def update_games_graph(full):
+    games_chain.update_graphs(full=full)
+
+
+@app.cli.command(help='Renders hot pages into cache for all languages and '
+                      'devices.')
+@click.option('--top-players', default=None, type=int)
+@click.option('--workers', default=None, type=int)
+@with_appcontext
+def warm_cache(top_players, workers):
+    urls = None
+    if top_players is not None:
+        urls = cache_warming.hot_urls(top_players)
+    cache_warming.warm(urls, workers=workers)  # logs the report
+
+
+@app.cli.command(help='Compares html parsing backends on saved pages.')
+@click.argument('path', default='')
+@with_appcontext
+def bench_html(path):
+    pages = benchmark.load_pages(path or app.config['PARSER_CACHE_DIR'])
+    app.logger.info(f'Pages: {len(pages)}')
+    for backend, result in benchmark.html_backends(pages).items():
+        app.logger.info(f'{backend}: {result}')
+
+
+def _use_database(uri):
+    """Switches the app to a separate database for benchmark data."""
+    if uri == app.config['SQLALCHEMY_DATABASE_URI']:
+        raise click.ClickException('Benchmarks write data, use a separate '
+                                   'database.')
+    db.session.remove()
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    db.create_all()
+
+
+@app.cli.command(help='Runs UA rating ingestion from http fixtures and '
+                      'reports throughput.')
+@click.argument('fixtures')
+@click.argument('month', type=int)
+@click.argument('year', type=int)
+@click.option('--database', required=True,
+              help='URI of a separate database for benchmark data.')
+@with_appcontext
+def bench_ingest(fixtures, month, year, database):
+    _use_database(database)
+    app.config.update(PARSER_FIXTURES=fixtures,
+                      PARSER_FIXTURES_MODE='replay')
+    crawler.reset_crawler()
+    try:
+        app.logger.info(f'Ingestion: {benchmark.ingestion(month, year)}')
+    finally:
+        crawler.reset_crawler()
+
+
+@app.cli.command(help='Runs statistics processors on a large synthetic '
+                      'dataset and checks their statements and time.')
+@click.option('--database', required=True,
+              help='URI of a separate database for benchmark data.')
+@click.option('--players', default=20000)
+@click.option('--tournaments', default=5000)
+@click.option('--games', default=500000)
+@click.option('--max-time', default=1.0)
+@with_appcontext
+def bench_statistics(database, players, tournaments, games, max_time):
+    _use_database(database)
+    if not models.Player.query.first():
+        app.logger.info('Generating data...')
+        benchmark.statistics_data(players, tournaments, games)
+    try:
+        results = benchmark.statistics_processors(max_time)
+    except AssertionError as e:
+        raise click.ClickException(str(e))
+    for name, result in results.items():
+        app.logger.info(f'{name}: {result}')
+
+
+@app.cli.command(help='Converts json games graphs to binary format.')
+@with_appcontext
+def convert_games_graph():
+    games_chain.convert_graphs()
+
+
+@app.cli.command(help='Compares games chain graph with networkx DiGraph.')
+@click.argument('path', default=games_chain.graph_path)
+@click.option('--queries', default=200)
 @with_appcontext
-def update_games_graph():
-    games_chain.update_graphs()
+def bench_graph(path, queries):
+    for name, result in benchmark.win_graphs(
+            path, queries, k=app.config.get('WIN_CHAIN_MAX_K', 5),
+            budget=app.config.get('WIN_CHAIN_BUDGET', 0.2)).items():
+        app.logger.info(f'{name}: {result}')
 
 
 @app.cli.command(help='Looks for new string and automatically '
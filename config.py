@@ -8,6 +8,7 @@ SQLALCHEMY_DATABASE_URI = 'sqlite:///app.db'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 CACHE_TYPE = 'simple'
 CACHE_DEFAULT_TIMEOUT = 0  # never expires
+CACHE_SEARCH_TIMEOUT = 60 * 60  # pages of arbitrary search queries
 SUPPORTED_LANGUAGES = {'ru': 'Русский', 'uk': 'Українська'}
 BABEL_DEFAULT_LOCALE = 'uk'
 HOME_PAGE = 'rating.rating'
@@ -25,8 +26,39 @@ BLUEPRINTS = ['views.rating', 'views.subscribers']
 LOG_PATH = f'{APP_NAME}.log'  # store in working dir
 LOG_ERROR_ON_EMAIL = True
 LOG_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+# PARSER
+CRAWLER_WORKERS = 8  # concurrent page downloads
+CRAWLER_PER_HOST = 4  # max concurrent requests to one host
+CRAWLER_TIMEOUT = 30  # seconds
+CRAWLER_RETRIES = 2
+CRAWLER_WINDOW = 16  # max requests in flight of one page stream
+PARSER_CACHE_DIR = 'cache/http'  # None disables response cache
+PARSER_CACHE_TTL = 7 * 24 * 3600  # seconds
+PARSER_CACHE_MAX_ENTRIES = 50000
+PARSER_HTML_BACKEND = 'lxml'  # or 'html.parser'
+PARSER_FIXTURES = None  # path to http fixtures archive (.zip)
+PARSER_FIXTURES_MODE = 'replay'  # 'record' or 'replay'
+PARSER_BATCH_SIZE = 1000  # rows per bulk insert
+PARSER_TOURNAMENT_BATCH_SIZE = 20  # tournaments stored and parsed at once
+BACKFILL_WORKERS = 4  # rating lists parsed in parallel by parse_ua_all
+WORLD_RATING_FIXTURES = None  # directory with ITTF XLS files to import
+WORLD_RATING_START_YEAR = 2001
+
+# WIN CHAIN
+WIN_CHAIN_BUDGET = 0.2  # seconds of the strongest chains search
+WIN_CHAIN_MAX_K = 5  # max chains of one search
+WIN_CHAIN_HOP_GAMES = 20  # latest games shown for every hop of a chain
+
+# STATISTICS
+STATISTICS_WORKERS = 4  # topic processors run in parallel by calculate
+ANALYTICS_SNAPSHOT = 'cache/analytics.npz'  # columns used by statistics
+
+# CACHE WARMING
+CACHE_WARM_TOP_PLAYERS = 20  # profiles of best players rendered after update
+CACHE_WARM_WORKERS = 4
 
 # JOBS
+DAG_WORKERS = 4  # subtasks of a rating update run concurrently
 JOBS = [
     {
         'id': 'update_ua_rating',
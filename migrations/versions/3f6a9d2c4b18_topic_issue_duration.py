@@ -0,0 +1,25 @@
+"""topic issue duration
+
+Revision ID: 3f6a9d2c4b18
+Revises: 8c41f0d2b7e3
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6a9d2c4b18'
+down_revision = '8c41f0d2b7e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('topic_issue', sa.Column('duration', sa.Float(),
+                                           nullable=True))
+
+
+def downgrade():
+    op.drop_column('topic_issue', 'duration')
@@ -0,0 +1,37 @@
+"""rating list ingest progress
+
+Revision ID: 5b2d7c1e9a40
+Revises: 31e80a5a598b
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2d7c1e9a40'
+down_revision = '31e80a5a598b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'rating_list_ingest',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('rating_list_id', sa.String(), nullable=False),
+        sa.Column('year', sa.Integer(), nullable=True),
+        sa.Column('month', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('rating_list_id')
+    )
+
+
+def downgrade():
+    op.drop_table('rating_list_ingest')
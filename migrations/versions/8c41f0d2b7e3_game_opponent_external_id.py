@@ -0,0 +1,25 @@
+"""game opponent external id
+
+Revision ID: 8c41f0d2b7e3
+Revises: 5b2d7c1e9a40
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41f0d2b7e3'
+down_revision = '5b2d7c1e9a40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('game', sa.Column('opponent_external_id', sa.Integer(),
+                                    nullable=True))
+
+
+def downgrade():
+    op.drop_column('game', 'opponent_external_id')
@@ -0,0 +1,25 @@
+"""topic issue data version
+
+Revision ID: a7e2c5d9f031
+Revises: 3f6a9d2c4b18
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e2c5d9f031'
+down_revision = '3f6a9d2c4b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('topic_issue', sa.Column('data_version', sa.String(),
+                                           nullable=True))
+
+
+def downgrade():
+    op.drop_column('topic_issue', 'data_version')
@@ -0,0 +1,36 @@
+"""dag run
+
+Revision ID: c4d8e1f7a263
+Revises: a7e2c5d9f031
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d8e1f7a263'
+down_revision = 'a7e2c5d9f031'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dag_run',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('timeline', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('dag_run')
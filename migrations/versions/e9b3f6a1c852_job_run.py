@@ -0,0 +1,41 @@
+"""job run
+
+Revision ID: e9b3f6a1c852
+Revises: c4d8e1f7a263
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9b3f6a1c852'
+down_revision = 'c4d8e1f7a263'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'job_run',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('duration', sa.Float(), nullable=True),
+        sa.Column('rows', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_job_run_name'), 'job_run', ['name'],
+                    unique=False)
+    op.create_index(op.f('ix_job_run_started_at'), 'job_run', ['started_at'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_job_run_started_at'), table_name='job_run')
+    op.drop_index(op.f('ix_job_run_name'), table_name='job_run')
+    op.drop_table('job_run')
@@ -0,0 +1,28 @@
+"""tournament player total
+
+Revision ID: f2a8c6d4e1b9
+Revises: e9b3f6a1c852
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a8c6d4e1b9'
+down_revision = 'e9b3f6a1c852'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # tournaments with stored players are complete, others are parsed again
+    op.execute('UPDATE tournament SET player_total = ('
+               'SELECT count(*) FROM player_tournament '
+               'WHERE player_tournament.tournament_id = tournament.id) '
+               'WHERE EXISTS (SELECT 1 FROM player_tournament '
+               'WHERE player_tournament.tournament_id = tournament.id)')
+
+
+def downgrade():
+    op.execute('UPDATE tournament SET player_total = NULL')
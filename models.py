@@ -4,7 +4,6 @@ import json
 
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import ForeignKey
-from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 
 db = SQLAlchemy()
@@ -25,7 +24,7 @@ class NameReprMixin:
 class TimeStampMixin:
     created_at = db.Column(db.DateTime, default=datetime.datetime.now)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.now,
-                          onupdate=func.now)
+                          onupdate=datetime.datetime.now)
 
 
 class WorldPlayer(NameReprMixin, TimeStampMixin, db.Model):
@@ -102,6 +101,71 @@ class RatingList(TimeStampMixin, db.Model):
         return f'UA Rating {self.year}.{self.month:0>2}'
 
 
+class RatingListIngest(TimeStampMixin, db.Model):
+    """Progress of rating list ingestion, used to resume backfills."""
+    STARTED = 'started'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    rating_list_id = db.Column(db.String, primary_key=True)
+    year = db.Column(db.Integer)
+    month = db.Column(db.Integer)
+    status = db.Column(db.String)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)
+    error = db.Column(db.Text)
+
+    def __str__(self):
+        return f'Ingest {self.rating_list_id} {self.status}'
+
+
+class JobRun(db.Model):
+    """Run of a scheduled job or subtask."""
+    DONE = 'done'
+    FAILED = 'failed'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String, index=True)
+    status = db.Column(db.String)
+    started_at = db.Column(db.DateTime, index=True)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)
+    rows = db.Column(db.Integer)  # rows inserted, updated or deleted
+    error = db.Column(db.Text)
+
+    def __str__(self):
+        return f'{self.name} {self.started_at} {self.status}'
+
+
+class DagRun(TimeStampMixin, db.Model):
+    """Run of subtasks graph with timeline of its steps."""
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String)
+    status = db.Column(db.String)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration = db.Column(db.Float)
+    _timeline = db.Column(db.Text, name='timeline', default='[]')
+
+    @property
+    def timeline(self):
+        """List of steps with name, status, start, end and error."""
+        return json.loads(self._timeline or '[]')
+
+    @timeline.setter
+    def timeline(self, steps):
+        self._timeline = json.dumps(steps)
+
+    def __str__(self):
+        return f'{self.name} {self.started_at} {self.status}'
+
+
 class Rating(TimeStampMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     player_id = db.Column(db.Integer, ForeignKey('player.id'))
@@ -171,6 +235,8 @@ class Game(TimeStampMixin, db.Model):
     player_id = db.Column(db.Integer, ForeignKey('player.id'))
     player_name = db.Column(db.String)
     opponent_id = db.Column(db.Integer, ForeignKey('player.id'))
+    # opponent link on reiting.com.ua, `opponent_id` is resolved from it
+    opponent_external_id = db.Column(db.Integer)
     opponent_name = db.Column(db.String)
     opponent_rating = db.Column(db.Float)
     player_rating = db.Column(db.Float)
@@ -221,6 +287,8 @@ class TopicIssue(TimeStampMixin, db.Model):
     topic_id = db.Column(db.Integer, ForeignKey('topic.id'))
     topic = relationship('Topic')
     new = db.Column(db.Boolean)
+    duration = db.Column(db.Float)  # processor wall time, seconds
+    data_version = db.Column(db.String)  # versions of processor inputs
 
     @property
     def data(self):
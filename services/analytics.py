@@ -0,0 +1,221 @@
+"""
+Columnar analytics snapshot.
+Columns of rating lists, ratings, tournaments, games and players are loaded
+into numpy arrays once per data version and saved to an `.npz` file, so
+statistics are computed by vectorized scans instead of ORM queries.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import extract, func
+
+from models import db, RatingList, Rating, Tournament, Game, Player
+
+CHUNK_SIZE = 100000  # rows fetched at once while loading
+
+# data sources of statistics
+RATING_LISTS = 'rating_lists'
+RATINGS = 'ratings'
+TOURNAMENTS = 'tournaments'
+GAMES = 'games'
+PLAYERS = 'players'
+
+SOURCES = {
+    RATING_LISTS: RatingList,
+    RATINGS: Rating,
+    TOURNAMENTS: Tournament,
+    GAMES: Game,
+    PLAYERS: Player,
+}
+
+# columns of snapshot tables: name -> (expression, dtype), nullable numbers
+# are floats with nan for NULL, NULL strings are empty
+TABLES = {
+    RATING_LISTS: {
+        'id': (RatingList.id, np.int64),
+        'year': (RatingList.year, np.int32),
+        'month': (RatingList.month, np.int32),
+    },
+    RATINGS: {
+        'year': (Rating.year, np.int32),
+        'month': (Rating.month, np.int32),
+        'rating': (Rating.rating, np.float64),
+    },
+    TOURNAMENTS: {
+        'id': (Tournament.id, np.int64),
+        'rating_list_id': (Tournament.rating_list_id, np.float64),
+        'year': (extract('year', Tournament.start_date), np.float64),
+        'city': (func.coalesce(Tournament.city, ''), str),
+        'judge': (func.coalesce(Tournament.judge, ''), str),
+    },
+    GAMES: {
+        'id': (Game.id, np.int64),
+        'tournament_id': (Game.tournament_id, np.float64),
+        'opponent_rating': (Game.opponent_rating, np.float64),
+        'contribution': (Game.contribution, np.float64),
+    },
+    PLAYERS: {
+        'id': (Player.id, np.int64),
+        'rating': (Player.rating, np.float64),
+        'game_total': (Player.game_total, np.int64),
+        'game_won': (Player.game_won, np.int64),
+    },
+}
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def data_versions():
+    """
+    Version of every data source: number of rows and the last update time,
+    so both new, changed and deleted rows change it.
+    """
+    columns = []
+    for model in SOURCES.values():
+        columns.append(db.session.query(func.count(model.id)).as_scalar())
+        columns.append(db.session.query(
+            func.max(model.updated_at)).as_scalar())
+    values = db.session.query(*columns).one()
+    return {source: f'{values[2 * i]}/{values[2 * i + 1]}'
+            for i, source in enumerate(SOURCES)}
+
+
+def _load_table(columns):
+    names = list(columns)
+    chunks = {name: [] for name in names}
+    query = db.session.query(*[expression for expression, _ in
+                               columns.values()])
+    result = db.session.execute(query.order_by(
+        columns[names[0]][0]).statement)
+    while True:
+        rows = result.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        for name, values in zip(names, zip(*rows)):
+            chunks[name].append(np.array(values, dtype=columns[name][1]))
+    return {name: np.concatenate(chunks[name]) if chunks[name] else
+            np.array([], dtype=columns[name][1]) for name in names}
+
+
+class Snapshot:
+    def __init__(self, version, tables):
+        """
+        :param version: json of data versions the snapshot was built from.
+        :param tables: source -> column name -> array.
+        """
+        self.version = version
+        self.tables = tables
+
+    def __getitem__(self, source):
+        return self.tables[source]
+
+    @classmethod
+    def build(cls, version):
+        return cls(version, {source: _load_table(columns)
+                             for source, columns in TABLES.items()})
+
+    def save(self, path):
+        """Writes `.npz` next to path and renames it, so it is atomic."""
+        arrays = {f'{source}.{name}': array
+                  for source, columns in self.tables.items()
+                  for name, array in columns.items()}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, version=np.array(self.version), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        tables = {source: {} for source in TABLES}
+        with np.load(path) as data:
+            version = str(data['version'])
+            for key in data.files:
+                if key != 'version':
+                    source, name = key.split('.', 1)
+                    tables[source][name] = data[key]
+        if any(set(tables[s]) != set(TABLES[s]) for s in TABLES):
+            raise ValueError(f'Unsupported snapshot columns in {path}')
+        return cls(version, tables)
+
+
+def refresh(versions=None):
+    """
+    Makes snapshot of the current data versions (computed if not given)
+    current: keeps loaded one, loads saved one or builds a new one.
+    """
+    global _snapshot
+    version = json.dumps(versions or data_versions(), sort_keys=True)
+    with _lock:
+        if _snapshot is not None and _snapshot.version == version:
+            return _snapshot
+        path = current_app.config.get('ANALYTICS_SNAPSHOT')
+        snapshot = None
+        if path and os.path.exists(path):
+            try:
+                snapshot = Snapshot.load(path)
+            except (ValueError, OSError, KeyError):
+                current_app.logger.exception('Broken analytics snapshot')
+        if snapshot is None or snapshot.version != version:
+            current_app.logger.info('Building analytics snapshot')
+            snapshot = Snapshot.build(version)
+            if path:
+                snapshot.save(path)
+        _snapshot = snapshot
+        return snapshot
+
+
+def snapshot():
+    """Returns the current snapshot, it is built on first use."""
+    return _snapshot or refresh()
+
+
+def group_count(keys, mask=None):
+    """Returns sorted distinct keys and number of rows of each."""
+    if mask is not None:
+        keys = keys[mask]
+    return np.unique(keys, return_counts=True)
+
+
+def count_of(keys, values, mask=None):
+    """Number of rows with every one of `values` keys."""
+    found, counts = group_count(keys, mask)
+    if not len(found):
+        return np.zeros(len(values), dtype=np.int64)
+    index = np.minimum(np.searchsorted(found, values), len(found) - 1)
+    return np.where(found[index] == values, counts[index], 0)
+
+
+def top_k(values, k, mask=None):
+    """
+    Indices of `k` greatest values in descending order, rows with equal
+    values are in their order, nan values are the smallest.
+    """
+    rows = np.flatnonzero(mask) if mask is not None else np.arange(
+        len(values))
+    values = values[rows]
+    values = np.where(np.isnan(values), -np.inf, values)
+    if 0 < k < len(values):
+        threshold = np.partition(values, len(values) - k)[len(values) - k]
+        keep = values >= threshold
+        rows, values = rows[keep], values[keep]
+    order = np.argsort(-values, kind='stable')[:k]
+    return rows[order]
+
+
+def histogram(values, step, mask=None):
+    """
+    Number of not nan values in bins of `step` width starting from zero,
+    returns counts and left edges of bins.
+    """
+    if mask is not None:
+        values = values[mask]
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return np.array([], dtype=np.int64), np.array([])
+    counts = np.bincount((np.maximum(values, 0) // step).astype(np.int64))
+    return counts, np.arange(len(counts)) * step
@@ -0,0 +1,242 @@
+"""
+Benchmarks of performance critical parts of services.
+Each benchmark returns a dict of results, `flask bench_*` commands print them.
+"""
+import datetime
+import os
+import random
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+from sqlalchemy import event
+
+import models
+from models import db
+from services import analytics, html_tables, parser, statistics
+from services.pipeline import batched
+from services.win_graph import WEIGHTS, WinGraph
+
+# tables extracted by parser from reiting.com.ua pages
+HTML_TABLES = [{}, {'id': 'sortTable'}, {'id': 'tourn-table'},
+               {'cls': 'striped'}]
+
+# max statements issued by a statistics processor over the analytics
+# snapshot, regardless of data size
+STATISTICS_STATEMENTS = 1
+
+
+@contextmanager
+def count_statements():
+    """Counts SQL statements executed within the block."""
+    counter = {'statements': 0}
+
+    def count(*args):
+        counter['statements'] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        yield counter
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def load_pages(path):
+    """Loads saved html pages (`.html` files or http cache bodies)."""
+    pages = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith('.html') or name.endswith('.body'):
+            with open(os.path.join(path, name), 'rb') as f:
+                pages.append(f.read())
+    return pages
+
+
+def html_backends(pages, repeat=3):
+    """Rows per second of every html_tables backend over pages."""
+    results = {}
+    for backend in html_tables.BACKENDS:
+        rows = 0
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for page in pages:
+                doc = html_tables.parse(page, backend)
+                for table in HTML_TABLES:
+                    rows += sum(1 for _ in doc.rows(**table))
+        elapsed = time.perf_counter() - start
+        results[backend] = {'rows': rows // repeat,
+                            'time': elapsed / repeat,
+                            'rows/sec': rows / elapsed if elapsed else 0}
+    return results
+
+
+def ingestion(month, year):
+    """
+    Throughput of full UA rating ingestion. Should be run in fixtures
+    replay mode against a separate database.
+    """
+    crawler = parser.CRAWLER._get_current_object()
+    pages = crawler.stats['pages']
+    rows = html_tables.STATS['rows']
+    start = time.perf_counter()
+    with count_statements() as counter:
+        parser.parse_ua(month, year)
+    elapsed = time.perf_counter() - start
+    pages = crawler.stats['pages'] - pages
+    rows = html_tables.STATS['rows'] - rows
+    return {'time': elapsed,
+            'pages': pages,
+            'pages/sec': pages / elapsed,
+            'rows': rows,
+            'rows/sec': rows / elapsed,
+            'statements': counter['statements']}
+
+
+def _build(factory):
+    """Returns built object, its allocated memory and build time."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = factory()
+    elapsed = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, memory, elapsed
+
+
+def win_graphs(path, queries=200, seed=0, k=3, budget=0.2):
+    """
+    Memory and query latency (mean, p50, p99 over random pairs of players)
+    of games chain graph saved to `path` as `WinGraph` and as networkx
+    DiGraph with Dijkstra search (the previous implementation), and
+    latency of the search of k strongest chains.
+    """
+    import networkx as nx
+
+    graph, memory, build_time = _build(lambda: WinGraph.load(path, False))
+    src = np.repeat(graph.ids, np.diff(graph.indptr)).tolist()
+    dst = graph.ids[graph.indices].tolist()
+    graphs = {
+        'WinGraph': (graph, memory, build_time),
+        'nx.DiGraph': _build(lambda: nx.DiGraph(zip(src, dst))),
+    }
+    nodes = graph.ids.tolist()
+    rng = random.Random(seed)
+    pairs = [(rng.choice(nodes), rng.choice(nodes)) for _ in range(queries)]
+
+    def nx_path(g, source, target):
+        try:
+            return nx.dijkstra_path(g, source, target)
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            return None
+
+    search = {'WinGraph': lambda g, s, t: g.shortest_path(s, t),
+              'nx.DiGraph': nx_path}
+    start = time.perf_counter()
+    WinGraph.load(path)
+    results = {'mmap open time': time.perf_counter() - start}
+    lengths = {}
+    for name, (graph, memory, build_time) in graphs.items():
+        paths = []
+        latencies = []
+        for s, t in pairs:
+            start = time.perf_counter()
+            paths.append(search[name](graph, s, t))
+            latencies.append(time.perf_counter() - start)
+        lengths[name] = [len(p) if p else 0 for p in paths]
+        results[name] = {'memory': memory,
+                         'build time': build_time,
+                         'query time': sum(latencies) / queries,
+                         'p50': float(np.percentile(latencies, 50)),
+                         'p99': float(np.percentile(latencies, 99)),
+                         'no path': lengths[name].count(0)}
+    results['same lengths'] = len(set(map(tuple, lengths.values()))) == 1
+    graph = graphs['WinGraph'][0]
+    for weight in WEIGHTS:
+        latencies = []
+        for s, t in pairs:
+            start = time.perf_counter()
+            graph.strongest_paths(s, t, weight, k, budget)
+            latencies.append(time.perf_counter() - start)
+        results[f'strongest {k} by {weight}'] = {
+            'p50': float(np.percentile(latencies, 50)),
+            'p99': float(np.percentile(latencies, 99))}
+    return results
+
+
+def _insert(model, rows, size=10000):
+    for batch in batched(rows, size):
+        db.session.bulk_insert_mappings(model, batch)
+    db.session.commit()
+
+
+def statistics_data(players=20000, tournaments=5000, games=500000,
+                    years=15, seed=0):
+    """Fills an empty database with random players, ratings and games."""
+    rng = random.Random(seed)
+    first_year = datetime.date.today().year - years + 1
+    lists = [(year, month) for year in range(first_year, first_year + years)
+             for month in range(1, 13)]
+    cities = [f'City {i}' for i in range(50)]
+    judges = [f'Judge {i}' for i in range(300)]
+    _insert(models.RatingList, ({'id': str(i), 'year': year, 'month': month}
+                                for i, (year, month) in enumerate(lists, 1)))
+    _insert(models.Player, ({
+        'id': i, 'name': f'Player {i}', 'external_id': i,
+        'year': rng.randint(1940, 2012), 'city': rng.choice(cities),
+        'category': rng.choice(models.Category.VALUES),
+        'rating': rng.uniform(0, 100), 'weight': rng.uniform(0, 10),
+        'tournaments_total': 0, 'game_total': 0, 'game_won': 0}
+        for i in range(1, players + 1)))
+    _insert(models.Rating, ({
+        'player_id': rng.randint(1, players), 'year': year, 'month': month,
+        'rating': rng.uniform(0, 100)}
+        for year, month in lists for _ in range(players // 10)))
+    _insert(models.Tournament, ({
+        'id': i, 'name': f'Tournament {i}', 'external_id': i,
+        'rating_list_id': i * len(lists) // (tournaments + 1) + 1,
+        'start_date': datetime.date(first_year, 1, 1) + datetime.timedelta(
+            days=i * years * 365 // (tournaments + 1)),
+        'city': rng.choice(cities), 'judge': rng.choice(judges)}
+        for i in range(1, tournaments + 1)))
+    _insert(models.Game, ({
+        'player_id': rng.randint(1, players),
+        'opponent_id': rng.randint(1, players),
+        'player_rating': rng.uniform(0, 100),
+        'opponent_rating': rng.uniform(0, 100),
+        'contribution': rng.randint(-5, 5), 'result': rng.random() < 0.5,
+        'tournament_id': rng.randint(1, tournaments)}
+        for _ in range(games)))
+    db.session.query(models.Player).update({
+        'game_total': models.Player.id % 200 + 100,
+        'game_won': models.Player.id % 97},
+        synchronize_session=False)
+    db.session.commit()
+
+
+def statistics_processors(max_time=None):
+    """
+    Statements and time of analytics snapshot build and of every
+    statistics topic processor. Fails if a processor issues more than
+    `STATISTICS_STATEMENTS` statements or runs longer than `max_time`
+    seconds.
+    """
+    statistics.create_default_topics()
+    start = time.perf_counter()
+    with count_statements() as counter:
+        analytics.refresh()
+    results = {'analytics snapshot': {'statements': counter['statements'],
+                                      'time': time.perf_counter() - start}}
+    for topic in models.Topic.query.order_by(models.Topic.id):
+        start = time.perf_counter()
+        with count_statements() as counter:
+            statistics.PROCESSORS[topic.processor](topic.properties)
+        elapsed = time.perf_counter() - start
+        results[topic.name] = {'processor': topic.processor,
+                               'statements': counter['statements'],
+                               'time': elapsed}
+        assert counter['statements'] <= STATISTICS_STATEMENTS, \
+            f'{topic.name}: {counter["statements"]} statements, ' \
+            f'expected at most {STATISTICS_STATEMENTS}'
+        assert max_time is None or elapsed <= max_time, \
+            f'{topic.name}: {elapsed:.2f} s, expected at most {max_time} s'
+    return results
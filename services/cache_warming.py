@@ -0,0 +1,91 @@
+"""
+Warming of the page cache after ingestion.
+Hot pages are rendered in request contexts for every language and both
+desktop and mobile templates, so the first visitors don't pay for renders.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from flask import current_app, g, url_for
+from werkzeug.exceptions import HTTPException
+
+from models import Category, Player
+
+# flask-mobility detects mobile devices by user agent
+USER_AGENTS = {
+    'desktop': 'Mozilla/5.0 (X11; Linux x86_64) Gecko/20100101 Firefox/60.0',
+    'mobile': 'Mozilla/5.0 (Linux; Android 8.0; Mobile) Gecko/20100101 '
+              'Firefox/60.0',
+}
+
+
+def hot_urls(top_players=20):
+    """Rating first pages, statistics and top players in all languages."""
+    app = current_app._get_current_object()
+    players = [id for id, in Player.query.with_entities(Player.id).order_by(
+        Player.rating.desc()).filter(Player.rating.isnot(None)).limit(
+        top_players)]
+    urls = []
+    for lang in app.config['SUPPORTED_LANGUAGES']:
+        with app.test_request_context():
+            g.lang = lang
+            urls.append(url_for('rating.rating'))
+            urls.extend(url_for('rating.rating', category=category)
+                        for category in Category.VALUES)
+            urls.append(url_for('rating.statistics'))
+            urls.extend(url_for('rating.player', id=id) for id in players)
+    return urls
+
+
+def _render(app, url, user_agent):
+    """
+    Renders url in a request context. The test client is not used: its
+    first request would run `before_first_request` handlers, which start
+    the scheduler in the updating process.
+    """
+    start = time.perf_counter()
+    with app.test_request_context(url, headers={'User-Agent': user_agent}):
+        try:
+            response = app.preprocess_request()
+            if response is None:
+                response = app.dispatch_request()
+            status = app.make_response(response).status_code
+        except HTTPException as e:
+            status = e.code
+        except Exception:
+            app.logger.exception(f'Failed to render {url}')
+            status = 500
+    return status, time.perf_counter() - start
+
+
+def warm(urls=None, workers=None):
+    """
+    Renders urls (hot pages by default) with every device variant in
+    parallel, returns a report of render times.
+    """
+    app = current_app._get_current_object()
+    config = app.config
+    urls = urls or hot_urls(config.get('CACHE_WARM_TOP_PLAYERS', 20))
+    pages = [(url, device) for url in urls for device in USER_AGENTS]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers or config.get('CACHE_WARM_WORKERS',
+                                                  4)) as executor:
+        results = list(executor.map(
+            lambda page: _render(app, page[0], USER_AGENTS[page[1]]),
+            pages))
+    times = [elapsed for _, elapsed in results]
+    slowest = sorted(zip(times, pages), reverse=True)[:5]
+    report = {
+        'pages': len(pages),
+        'failed': [page for page, (status, _) in zip(pages, results)
+                   if status != 200],
+        'time': time.perf_counter() - start,
+        'render time': sum(times),
+        'p50': float(np.percentile(times, 50)) if times else 0,
+        'max': max(times, default=0),
+        'slowest': [(f'{url} {device}', round(elapsed, 3))
+                    for elapsed, (url, device) in slowest],
+    }
+    app.logger.info(f'Cache warming: {report}')
+    return report
@@ -0,0 +1,132 @@
+"""
+HTTP crawling layer for parsers.
+Keeps one pooled keep-alive `requests.Session` and fetches pages concurrently
+on a bounded thread pool. Workers do network I/O only: responses are handed
+back to the caller, so all DB writes stay in the caller's session.
+"""
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+from services import http_fixtures
+from services.http_cache import ResponseCache
+
+_crawler = None
+
+
+class Crawler:
+    def __init__(self, workers=8, per_host=4, timeout=30, retries=2,
+                 cache=None, fixtures=None, fixtures_mode=None, window=None):
+        """
+        :param fixtures: path to http fixtures archive.
+        :param fixtures_mode: 'record' saves fetched pages to fixtures,
+        'replay' serves pages from fixtures without network.
+        :param window: max requests in flight of one `fetch_iter` stream.
+        """
+        self.workers = workers
+        self.per_host = per_host
+        self.window = window or workers * 2
+        self.timeout = timeout
+        self.cache = cache
+        self.stats = {'pages': 0, 'failed': 0}
+        self.session = requests.Session()
+        pool = dict(pool_connections=workers, pool_maxsize=workers,
+                    max_retries=retries)
+        if fixtures_mode == http_fixtures.RECORD:
+            adapter = http_fixtures.RecordingAdapter(fixtures, **pool)
+        elif fixtures_mode == http_fixtures.REPLAY:
+            adapter = http_fixtures.ReplayAdapter(fixtures)
+        else:
+            adapter = HTTPAdapter(**pool)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get(self, url):
+        """
+        Returns response or None if the page could not be fetched.
+        With cache enabled response has `unchanged` attribute set if the page
+        is the same as on previous fetch.
+        """
+        headers = self.cache.headers(url) if self.cache else None
+        with self._host_slot(url):
+            try:
+                response = self.session.get(url, timeout=self.timeout,
+                                            headers=headers)
+            except requests.RequestException:
+                self._count('failed')
+                return None
+        self._count('pages')
+        if self.cache:
+            response = self.cache.update(url, response)
+        return response
+
+    def fetch_iter(self, urls):
+        """
+        Yields responses in the order of urls, keeps at most `window`
+        requests in flight, so only a few pages are in memory at once.
+        """
+        pending = deque()
+        for url in urls:
+            pending.append(self._executor.submit(self.get, url))
+            if len(pending) >= self.window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+    def close(self):
+        """Stops workers and closes the session with its adapters."""
+        self._executor.shutdown()
+        self.session.close()
+
+
+def get_crawler():
+    global _crawler
+    if _crawler is None:
+        config = current_app.config
+        cache = None
+        fixtures_mode = config.get('PARSER_FIXTURES') and \
+            config.get('PARSER_FIXTURES_MODE', http_fixtures.REPLAY)
+        # fixtures need full pages: recording conditional 304 answers or
+        # skipping unchanged pages would leave them incomplete
+        if config.get('PARSER_CACHE_DIR') and not fixtures_mode:
+            cache = ResponseCache(
+                config['PARSER_CACHE_DIR'],
+                ttl=config.get('PARSER_CACHE_TTL', 7 * 24 * 3600),
+                max_entries=config.get('PARSER_CACHE_MAX_ENTRIES', 50000))
+        _crawler = Crawler(workers=config.get('CRAWLER_WORKERS', 8),
+                           per_host=config.get('CRAWLER_PER_HOST', 4),
+                           timeout=config.get('CRAWLER_TIMEOUT', 30),
+                           retries=config.get('CRAWLER_RETRIES', 2),
+                           window=config.get('CRAWLER_WINDOW'),
+                           cache=cache,
+                           fixtures=config.get('PARSER_FIXTURES'),
+                           fixtures_mode=fixtures_mode)
+    return _crawler
+
+
+def reset_crawler():
+    """Closes crawler, next one is created from the current config."""
+    global _crawler
+    if _crawler is not None:
+        _crawler.close()
+    _crawler = None
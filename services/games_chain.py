@@ -6,90 +6,197 @@ so the result would be Bob -> Bill -> John.
 Potentially even very weak player would have such "chain of wins" for best
 players:
     <some_player> -> <player1> -> <player2> ... <playerN>.
-Module uses `networkx` with Dijkstra search. It is a real memory devourer...
-In order not to compile json data each time you restart the app, it uses
-compiled json file witch is initialized if it`s doesn`t exist.
+Graphs are kept as compact arrays (see `services.win_graph`) and searched
+with breadth first search. They are saved in binary format and opened with
+mmap, so workers don't parse anything on start and share graph memory.
+Graphs are updated incrementally: results of pairs of players are kept
+with the last counted game and only newer games are counted on update,
+pairs of players whose older games were changed since (e.g. opponents
+resolved later) are counted again.
+Graphs saved as json by older versions are converted by `convert_graphs`.
 """
-import sys
-import networkx as nx
+import datetime
 import json
 import os
+import numpy as np
 import models as m
 from flask import current_app
+from sqlalchemy import Integer, cast, func, tuple_
+from sqlalchemy.orm import joinedload
+from models import db
+from services.pipeline import batched
+from services.win_graph import PairCounts, WinGraph
+
+CHUNK_SIZE = 50000  # rows of aggregate fetched at once
 
 GRAPH = {}
 GRAPH_ALL = {}
-graph_path = 'static/graph.json'
-graph_all_path = 'static/graph_all.json'
-
-
-def update_graphs():
-    current_app.logger.info('Updating Game chain Graphs:')
-    graph = {}
-    graph_all = {}
-    games_iter = m.Game.query.paginate(per_page=10000, page=1)
-    pages = games_iter.pages
-    all_games = games_iter.items
-    sys.stdout.write('Progress: 0 %')
-    for page in range(2, pages + 1):
-        for g in all_games:
-            if g.opponent_id:
-                if g.result:
-                    if not graph.get(g.player_id):
-                        graph[g.player_id] = set()
-                    graph[g.player_id].add(g.opponent_id)
-
-                if not graph_all.get(g.player_id):
-                    graph_all[g.player_id] = {}
-                if not graph_all[g.player_id].get(g.opponent_id):
-                    graph_all[g.player_id][
-                        g.opponent_id] = 1 if g.result else -1
-                else:
-                    graph_all[g.player_id][
-                        g.opponent_id] += 1 if g.result else -1
-        all_games = m.Game.query.paginate(per_page=10000, page=page).items
-        sys.stdout.write(f'\rProgress: {(page-1)/pages*100:.3} %')
-    for g in graph:
-        graph[g] = list(graph[g])
-    for g in graph_all:
-        graph_all[g] = [p for p, s in graph_all[g].items() if s > 0]
-
-    with open(graph_path, 'w') as f:
-        f.write(json.dumps(graph))
-
-    with open(graph_all_path, 'w') as f:
-        f.write(json.dumps(graph_all))
-
-    sys.stdout.write('\rProgress: 100 %\n')
-    current_app.logger.info("Graph initialized.")
+graph_path = 'static/graph'
+graph_all_path = 'static/graph_all'
+# results of pairs of players, graphs are built from
+pairs_path = 'static/graph_pairs'
+# json graphs of older versions
+graph_json_path = 'static/graph.json'
+graph_all_json_path = 'static/graph_all.json'
+
+
+def update_graphs(full=False):
+    """
+    Applies games added since the last update to the stored results of
+    pairs of players and saves graphs built from them.
+    :param full: recounts results of all games.
+    """
+    pairs = None
+    if not full and os.path.exists(pairs_path):
+        try:
+            pairs = PairCounts.load(pairs_path)
+        except ValueError as e:
+            current_app.logger.info(f'Counts are outdated: {e}')
+    # taken before counting, so games changed meanwhile are counted again
+    counted_at = datetime.datetime.now()
+    watermark = db.session.query(func.max(m.Game.id)).scalar() or 0
+    changed = []
+    if pairs is not None:
+        changed = [id for id, in changed_players(pairs, counted_at)]
+    if pairs is None:
+        current_app.logger.info('Rebuilding Game chain Graphs...')
+        pairs = count_pairs(0, watermark)
+    elif watermark > pairs.watermark or changed:
+        current_app.logger.info(f'Updating Game chain Graphs with games '
+                                f'{pairs.watermark + 1}-{watermark} and '
+                                f'{len(changed)} changed players...')
+        if changed:
+            pairs = pairs.replace(changed, count_pairs(
+                0, pairs.watermark, changed_players(pairs, counted_at)))
+        pairs = pairs.merge(count_pairs(pairs.watermark, watermark))
+    elif WinGraph.is_current(graph_path) and \
+            WinGraph.is_current(graph_all_path):
+        current_app.logger.info('Game chain Graphs are up to date.')
+        return
+    pairs.counted_at = counted_at.timestamp()
+    pairs.save(pairs_path)
+    pairs.graph().save(graph_path)
+    pairs.graph_all().save(graph_all_path)
+    current_app.logger.info(f"Graph initialized: {len(pairs)} pairs.")
+
+
+def changed_players(pairs, until):
+    """
+    Query of players whose counted games were changed after counting and
+    not later than `until`.
+    """
+    return db.session.query(m.Game.player_id).filter(
+        m.Game.id <= pairs.watermark, m.Game.player_id.isnot(None),
+        m.Game.updated_at > datetime.datetime.fromtimestamp(
+            pairs.counted_at),
+        m.Game.updated_at <= until).distinct()
+
+
+def count_pairs(after_id, to_id, players=None):
+    """
+    Counts results of pairs in games with ids in (after_id, to_id] with one
+    GROUP BY query, rows are streamed into arrays by chunks.
+    :param players: list or query of ids, games of them only are counted.
+    """
+    won = cast(m.Game.result, Integer)
+    wins = func.sum(won)
+    query = db.session.query(
+        m.Game.player_id, m.Game.opponent_id, wins,
+        2 * wins - func.count(m.Game.id),
+        func.coalesce(func.sum(m.Game.contribution * won), 0),
+        func.coalesce(func.max(m.Game.opponent_rating * won), 0)).filter(
+        m.Game.player_id.isnot(None), m.Game.opponent_id.isnot(None),
+        m.Game.id > after_id, m.Game.id <= to_id)
+    if players is not None:
+        query = query.filter(m.Game.player_id.in_(players))
+    query = query.group_by(m.Game.player_id, m.Game.opponent_id)
+    chunks = [np.array(rows, dtype=np.float64).reshape(-1, 6) for rows in
+              batched(query.yield_per(CHUNK_SIZE), CHUNK_SIZE)]
+    if not chunks:
+        return PairCounts.empty(to_id)
+    # pairs are unique in aggregate, chunks don't need merging
+    return PairCounts(*np.concatenate(chunks).T, watermark=to_id)
 
 
 def format_graph(graph):
-    return nx.DiGraph(
-        [(int(k), v) for k, nodes in graph.items() for v in nodes])
+    return WinGraph.from_adjacency(graph)
+
 
+def convert_graphs():
+    """Converts json graphs to binary format."""
+    for json_path, path in ((graph_json_path, graph_path),
+                            (graph_all_json_path, graph_all_path)):
+        with open(json_path) as f:
+            graph = format_graph(json.load(f))
+        graph.save(path)
+        current_app.logger.info(f'{json_path} -> {path}: {len(graph)} '
+                                f'players, {graph.edges} wins')
 
-def init_nx():
+
+def init_graphs():
     global GRAPH
     global GRAPH_ALL
 
     if os.path.exists(graph_path):
-        with open(graph_path) as f, open(graph_all_path) as f2:
-            g = json.load(f)
-            g_all = json.load(f2)
-            GRAPH = format_graph(g)
-            GRAPH_ALL = format_graph(g_all)
-            current_app.logger.info('Graph initialized from file')
+        GRAPH = WinGraph.load(graph_path)
+        GRAPH_ALL = WinGraph.load(graph_all_path)
+        current_app.logger.info('Graph initialized from file')
     else:
         raise Exception('Failed to load games chain graph. No such file')
 
 
 def find_chain(player1_id, player2_id, all=False):
     if not GRAPH:
-        init_nx()
-    try:
-        g = GRAPH_ALL if all else GRAPH
-        path = nx.dijkstra_path(g, player1_id, player2_id)
-    except nx.NetworkXNoPath:
+        init_graphs()
+    g = GRAPH_ALL if all else GRAPH
+    path = g.shortest_path(player1_id, player2_id)
+    if path is None:
         return None
-    return [m.Player.query.get(id) for id in path]
+    return _players([path])[0]
+
+
+def find_strongest_chains(player1_id, player2_id, all=False,
+                          weight='rating', k=1):
+    """
+    Up to k chains with the strongest wins, weighted by opponent rating or
+    by contribution (see `WinGraph.strongest_paths`).
+    """
+    if not GRAPH:
+        init_graphs()
+    g = GRAPH_ALL if all else GRAPH
+    config = current_app.config
+    paths = g.strongest_paths(player1_id, player2_id, weight,
+                              min(k, config.get('WIN_CHAIN_MAX_K', 5)),
+                              config.get('WIN_CHAIN_BUDGET', 0.2))
+    return _players(paths)
+
+
+def _players(paths):
+    """Players of paths of ids with one query."""
+    ids = {id for path in paths for id in path}
+    players = {p.id: p for p in m.Player.query.filter(m.Player.id.in_(ids))}
+    return [[players[id] for id in path] for path in paths]
+
+
+def chain_games(chain, all=False):
+    """
+    Games of every hop of chain: wins of player over the next one, or all
+    games between them if `all`. Games of all hops are fetched with one
+    query, at most `WIN_CHAIN_HOP_GAMES` latest games of each hop are kept.
+    :return: list of games of every hop, the latest first.
+    """
+    limit = current_app.config.get('WIN_CHAIN_HOP_GAMES', 20)
+    pairs = [(player.id, opponent.id)
+             for player, opponent in zip(chain, chain[1:])]
+    if not pairs:
+        return []
+    query = m.Game.query.options(joinedload(m.Game.tournament)).filter(
+        tuple_(m.Game.player_id, m.Game.opponent_id).in_(pairs))
+    if not all:
+        query = query.filter(m.Game.result.is_(True))
+    games = {pair: [] for pair in pairs}
+    for game in query.order_by(m.Game.date.desc(), m.Game.id.desc()):
+        hop = games[game.player_id, game.opponent_id]
+        if len(hop) < limit:
+            hop.append(game)
+    return [games[pair] for pair in pairs]
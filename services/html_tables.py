@@ -0,0 +1,120 @@
+"""
+Table rows extraction from html pages for parsers.
+Row is a list of `Cell(text, href)` for every <td> of a <tr>, where `text` is
+the first text node of the cell and `href` is the link of its first <a>.
+Backends:
+    - 'html.parser' - BeautifulSoup with python html parser (slow).
+    - 'lxml' - streams over <tr> elements of the table with lxml
+      `iterparse`, nothing but the current row is kept in memory.
+"""
+from collections import namedtuple
+from io import BytesIO
+
+from bs4 import BeautifulSoup
+from flask import current_app
+from lxml import etree
+
+Cell = namedtuple('Cell', 'text href')
+
+STATS = {'rows': 0}  # extracted rows, used by benchmarks
+
+
+def _matches(attrs, id=None, cls=None):
+    if id and attrs.get('id') != id:
+        return False
+    if cls and cls not in (attrs.get('class') or '').split():
+        return False
+    return True
+
+
+class SoupDocument:
+    def __init__(self, html):
+        self.soup = BeautifulSoup(html, 'html.parser')
+
+    def rows(self, id=None, cls=None):
+        attrs = {}
+        if id:
+            attrs['id'] = id
+        if cls:
+            attrs['class'] = cls
+        table = self.soup.find('table', attrs)
+        if not table:
+            return
+        for tr in table.findAll('tr'):
+            STATS['rows'] += 1
+            yield [self._cell(td) for td in tr.findAll('td')]
+
+    @staticmethod
+    def _cell(td):
+        a = td.find('a')
+        return Cell(td.find(text=True), a.get('href') if a else None)
+
+
+class LxmlDocument:
+    def __init__(self, html):
+        self.encoding = None  # detected by lxml from bytes
+        if isinstance(html, str):
+            html = html.encode()
+            self.encoding = 'utf-8'
+        self.html = html
+
+    def rows(self, id=None, cls=None):
+        table = None  # matched <table> element
+        starts = []  # start numbers of open <tr>
+        nested = []  # (start number, row) of <tr> inside the open one
+        started = 0
+        for event, el in etree.iterparse(BytesIO(self.html), html=True,
+                                         events=('start', 'end'),
+                                         tag=('table', 'tr'),
+                                         encoding=self.encoding):
+            if el.tag == 'table':
+                if event == 'start' and table is None and \
+                        _matches(el.attrib, id, cls):
+                    table = el
+                elif event == 'end' and el is table:
+                    return
+                elif event == 'end' and not starts:
+                    self._free(el)
+            elif table is None:
+                if event == 'end':
+                    self._free(el)
+            else:
+                if event == 'start':
+                    starts.append(started)
+                    started += 1
+                    continue
+                STATS['rows'] += 1
+                nested.append((starts.pop(), [self._cell(td)
+                                              for td in el.iter('td')]))
+                if not starts:
+                    # rows of nested tables end first, they follow the
+                    # outer row as in the document
+                    for _, row in sorted(nested, key=lambda r: r[0]):
+                        yield row
+                    nested = []
+                    self._free(el)
+
+    @staticmethod
+    def _free(el):
+        """Drops parsed element and its preceding siblings from the tree."""
+        el.clear()
+        while el.getprevious() is not None:
+            del el.getparent()[0]
+
+    @staticmethod
+    def _cell(td):
+        a = next(td.iter('a'), None)
+        return Cell(next(td.itertext(), None),
+                    a.get('href') if a is not None else None)
+
+
+BACKENDS = {
+    'html.parser': SoupDocument,
+    'lxml': LxmlDocument,
+}
+
+
+def parse(html, backend=None):
+    backend = backend or current_app.config.get('PARSER_HTML_BACKEND',
+                                                'html.parser')
+    return BACKENDS[backend](html)
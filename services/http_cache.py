@@ -0,0 +1,143 @@
+"""
+On-disk HTTP response cache for parsers.
+Entries are keyed by URL and keep ETag/Last-Modified headers and a hash of
+the body, so a page can be revalidated with a conditional request and the
+parser can tell an unchanged page before parsing it.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+
+class ResponseCache:
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=50000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'requests': 0, 'not_modified': 0, 'same_body': 0,
+                      'bytes_saved': 0, 'evicted': 0}
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _file(self, url, ext):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.path, f'{key}.{ext}')
+
+    def _entry(self, url):
+        try:
+            with open(self._file(url, 'json')) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['checked_at'] > self.ttl:
+            return None
+        return entry
+
+    def _save(self, url, entry, body=None):
+        if body is not None:
+            with open(self._file(url, 'body'), 'wb') as f:
+                f.write(body)
+        with open(self._file(url, 'json'), 'w') as f:
+            json.dump(entry, f)
+
+    def headers(self, url):
+        """Conditional request headers for the cached version of url."""
+        entry = self._entry(url)
+        if not entry:
+            return {}
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def update(self, url, response):
+        """
+        Stores response of url and marks it with `unchanged` attribute.
+        Response to a conditional request (304) is replaced with the cached
+        one.
+        """
+        self._count('requests')
+        entry = self._entry(url)
+        response.unchanged = False
+        if response.status_code == 304 and entry:
+            cached = requests.Response()
+            cached.status_code = 200
+            cached.url = entry['final_url']
+            cached.headers = response.headers
+            cached.encoding = entry['encoding']
+            try:
+                with open(self._file(url, 'body'), 'rb') as f:
+                    cached._content = f.read()
+            except OSError:
+                return response
+            cached.unchanged = True
+            entry['checked_at'] = time.time()
+            self._save(url, entry)
+            self._count('not_modified')
+            self._count('bytes_saved', entry['size'])
+            return cached
+        if response.status_code != 200:
+            return response
+
+        body_hash = hashlib.sha1(response.content).hexdigest()
+        response.unchanged = bool(entry and entry['hash'] == body_hash)
+        if response.unchanged:
+            self._count('same_body')
+        self._save(url, {
+            'url': url,
+            'final_url': response.url,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'encoding': response.encoding,
+            'hash': body_hash,
+            'size': len(response.content),
+            'checked_at': time.time()
+        }, None if response.unchanged else response.content)
+        return response
+
+    def forget(self, url):
+        for ext in ('json', 'body'):
+            try:
+                os.remove(self._file(url, ext))
+            except OSError:
+                pass
+
+    def evict(self):
+        """Removes expired entries and the oldest ones above max_entries."""
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    entries.append((json.load(f)['checked_at'], name[:-5]))
+            except (OSError, ValueError, KeyError):
+                entries.append((0, name[:-5]))
+        entries.sort(reverse=True)
+        now = time.time()
+        for i, (checked_at, key) in enumerate(entries):
+            if i < self.max_entries and now - checked_at <= self.ttl:
+                continue
+            for ext in ('json', 'body'):
+                try:
+                    os.remove(os.path.join(self.path, f'{key}.{ext}'))
+                except OSError:
+                    pass
+            self._count('evicted')
+
+    def __str__(self):
+        return ', '.join(f'{k}: {v}' for k, v in self.stats.items())
@@ -0,0 +1,82 @@
+"""
+Record/replay of HTTP traffic for parsers.
+In record mode every response (including redirects) passing the crawler
+session is saved to a compressed zip archive. In replay mode the session is
+served from the archive by a local transport adapter, so ingestion runs
+offline and repeatably; pages missing from the archive are answered with 404.
+"""
+import hashlib
+import json
+import threading
+import zipfile
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+RECORD = 'record'
+REPLAY = 'replay'
+
+
+def _key(url):
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+class RecordingAdapter(HTTPAdapter):
+    def __init__(self, path, *args, **kwargs):
+        super(RecordingAdapter, self).__init__(*args, **kwargs)
+        self.path = path
+        self._lock = threading.Lock()
+        # the archive is written until `close`, which saves its directory
+        self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        self.keys = set()
+
+    def send(self, request, **kwargs):
+        response = super(RecordingAdapter, self).send(request, **kwargs)
+        meta = {'url': request.url,
+                'status_code': response.status_code,
+                'headers': dict(response.headers),
+                'encoding': response.encoding}
+        key = _key(request.url)
+        with self._lock:
+            if key not in self.keys:
+                self.keys.add(key)
+                self.archive.writestr(f'{key}.json', json.dumps(meta))
+                self.archive.writestr(f'{key}.body', response.content)
+        return response
+
+    def close(self):
+        super(RecordingAdapter, self).close()
+        with self._lock:
+            self.archive.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, path):
+        super(ReplayAdapter, self).__init__()
+        self._lock = threading.Lock()
+        self.archive = zipfile.ZipFile(path)
+        self.keys = set(self.archive.namelist())
+
+    def send(self, request, **kwargs):
+        response = Response()
+        response.request = request
+        response.url = request.url
+        response._content_consumed = True
+        key = _key(request.url)
+        if f'{key}.json' not in self.keys:
+            response.status_code = 404
+            response._content = b''
+            return response
+        with self._lock:
+            meta = json.loads(self.archive.read(f'{key}.json').decode())
+            response._content = self.archive.read(f'{key}.body')
+        response.status_code = meta['status_code']
+        response.headers = CaseInsensitiveDict(meta['headers'])
+        # body is stored decoded
+        response.headers.pop('Content-Encoding', None)
+        response.encoding = meta['encoding']
+        return response
+
+    def close(self):
+        self.archive.close()
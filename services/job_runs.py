@@ -0,0 +1,84 @@
+"""
+Persisted history of jobs and subtasks.
+`record` stores a `JobRun` with timing, outcome and number of rows the job
+inserted, updated or deleted, counted by an engine event in the job thread.
+Threads running parts of a job add their rows to it with `inherit`.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event
+
+from models import db, JobRun
+
+_local = threading.local()
+_lock = threading.Lock()  # counters are shared by threads of a job
+
+
+def _count_rows(conn, cursor, statement, parameters, context, executemany):
+    counters = getattr(_local, 'counters', None)
+    if counters and cursor.rowcount > 0 and (
+            context.isinsert or context.isupdate or context.isdelete):
+        with _lock:
+            for counter in counters:
+                counter['rows'] += cursor.rowcount
+
+
+def _save(run):
+    counters, _local.counters = getattr(_local, 'counters', []), []
+    try:
+        with db.engine.begin() as conn:  # outside of the job session
+            conn.execute(JobRun.__table__.insert(), run)
+    except Exception as e:
+        current_app.logger.error(f'Job run {run["name"]} not saved: {e}')
+    finally:
+        _local.counters = counters
+
+
+@contextmanager
+def record(name):
+    """
+    Records the block as a run of job `name`. Failed runs are recorded
+    with the error and the exception is re-raised.
+    """
+    if not event.contains(db.engine, 'after_cursor_execute', _count_rows):
+        event.listen(db.engine, 'after_cursor_execute', _count_rows)
+    counter = {'rows': 0}
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    _local.counters.append(counter)
+    run = {'name': name, 'started_at': datetime.now(),
+           'status': JobRun.DONE, 'error': None}
+    start = time.perf_counter()
+    try:
+        yield counter
+    except Exception as e:
+        run.update(status=JobRun.FAILED, error=str(e))
+        raise
+    finally:
+        _local.counters = [c for c in _local.counters if c is not counter]
+        run.update(finished_at=datetime.now(), rows=counter['rows'],
+                   duration=time.perf_counter() - start)
+        _save(run)
+
+
+def current():
+    """Counters of jobs recorded in the current thread."""
+    return list(getattr(_local, 'counters', []))
+
+
+@contextmanager
+def inherit(counters):
+    """
+    Rows written in the block are counted in `counters` too, they are
+    taken by `current` in the thread the block is run for.
+    """
+    previous = getattr(_local, 'counters', [])
+    _local.counters = list(counters)
+    try:
+        yield
+    finally:
+        _local.counters = previous
@@ -2,33 +2,65 @@
 Utils service for parsing rankings data from reiting.com.ua
 """
 import datetime
+import os
 import re
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import groupby
 
 import requests
 from bs4 import BeautifulSoup
 from flask import current_app
+from sqlalchemy import func, or_
 from werkzeug.local import LocalProxy
 
 from models import (db, Player, Tournament, Game, RatingList, Rating,
-                    PlayerTournament, City)
+                    PlayerTournament, City, RatingListIngest, Country,
+                    WorldPlayer, WorldRating, WorldRatingList)
 from models import Category
+from services import html_tables, world_rating
+from services.crawler import get_crawler
+from services.pipeline import Pipeline, batched
+from services.player_map import PlayerMap
+from services.rating_diff import Diff, load_rows, bulk_update
+from services.world_rating import WorldPlayerMap
 
 WORLD_RATING = "http://www.old.ittf.com/ittf_ranking/PDF/%s_%s_%s.xls"
 UA_RATING = "http://reiting.com.ua/rating"
 UA_RATING_T = "http://reiting.com.ua/rating/nat/%s/0/?fs=&limit=0&male=%s"
 UA_RATING_DOMEN = 'http://reiting.com.ua'
 
+PLAYER_FIELDS = ('external_id', 'name', 'category', 'position', 'rating',
+                 'fine_rating', 'weight', 'year', 'prev_rating', 'city',
+                 'city2')
+RATING_FIELDS = ('player_id', 'rating', 'rating_fine', 'weight', 'position',
+                 'month', 'year')
+
+# ITTF file codes of world rating categories
+WORLD_CATEGORIES = {
+    Category.MEN: 'SEN_MS',
+    Category.WOMEN: 'SEN_WS',
+}
+
 CATEGORY_MAPPINGS = {
     '100_M': Category.MEN,
     '100_W': Category.WOMEN,
 }
 
+# stored tournament, what games of it need
+TournamentRef = namedtuple('TournamentRef', 'id start_date')
+
 LOG = LocalProxy(lambda: current_app.logger)
+CRAWLER = LocalProxy(get_crawler)
+# serializes DB writes of concurrent ingestions (see `parse_ua_all`)
+WRITE_LOCK = threading.RLock()
 
 
-def parse_ua_by_external_id(rating_id, month, year):
+def parse_ua_by_external_id(rating_id, month, year, update_players=True):
     LOG.debug(f'Called rating parse: rating id: {rating_id}.')
-    rating_list = RatingList.query.filter_by(rating_id=rating_id).first()
+    rating_list = RatingList.query.get(str(rating_id))
     updated_data = {'players': set(), 'cities': set(), 'tournaments': set()}
     if rating_list:  # rating was already parsed
         LOG.debug('Rating already parsed. Parsing for updates.')
@@ -38,29 +70,42 @@ def parse_ua_by_external_id(rating_id, month, year):
         rating_list.month = month
         rating_list.id = str(rating_id)
 
+    player_map = PlayerMap()
     res = parse_ua_by_category(month, year, category=Category.MEN,
                                rating_id=rating_id,
-                               parse_tourn=False)
-    updated = False
-    for k, v in res.items():
-        if v:
-            updated = True
-        updated_data[k].update(v)
+                               parse_tourn=False, player_map=player_map,
+                               update_players=update_players)
     if res == -1:
         LOG.debug('Rating cannot be parsed')
         return
-    res = parse_ua_by_category(month, year, category=Category.WOMEN,
-                               rating_id=rating_id)
     for k, v in res.items():
         updated_data[k].update(v)
+    res = parse_ua_by_category(month, year, category=Category.WOMEN,
+                               rating_id=rating_id, player_map=player_map,
+                               update_players=update_players)
+    if res != -1:
+        for k, v in res.items():
+            updated_data[k].update(v)
 
-    db.session.add(rating_list)
-    db.session.commit()
+    with WRITE_LOCK:
+        db.session.add(rating_list)
+        db.session.commit()
 
-    return updated_data if updated else None
+    return updated_data if any(updated_data.values()) else None
 
 
 def parse_ua(month=None, year=None):
+    if CRAWLER.cache:
+        CRAWLER.cache.reset_stats()
+    try:
+        return _parse_ua(month, year)
+    finally:
+        if CRAWLER.cache:
+            CRAWLER.cache.evict()
+            LOG.info(f'HTTP cache: {CRAWLER.cache}')
+
+
+def _parse_ua(month, year):
     LOG.debug(f'Called rating parse: month: {month}, year: {year}.')
     year = year or datetime.datetime.now().year
     month = month or datetime.datetime.now().month
@@ -81,21 +126,23 @@ def parse_ua(month=None, year=None):
             rating_list.month = month
             rating_list.id = str(rating_id)
             updated_data['new'] = rating_list
+    player_map = PlayerMap()
     res = parse_ua_by_category(month, year, category=Category.MEN,
                                rating_id=rating_id,
-                               parse_tourn=False)
+                               parse_tourn=False, player_map=player_map)
+    if res == -1:
+        LOG.debug('Rating cannot be parsed')
+        return
     updated = False
     for k, v in res.items():
         if v:
             updated = True
         updated_data[k].update(v)
-    if res == -1:
-        LOG.debug('Rating cannot be parsed')
-        return
     res = parse_ua_by_category(month, year, category=Category.WOMEN,
-                               rating_id=rating_id)
-    for k, v in res.items():
-        updated_data[k].update(v)
+                               rating_id=rating_id, player_map=player_map)
+    if res != -1:
+        for k, v in res.items():
+            updated_data[k].update(v)
 
     db.session.add(rating_list)
     db.session.commit()
@@ -104,18 +151,15 @@ def parse_ua(month=None, year=None):
 
 
 def get_all_rating_lists():
-    page = requests.get(UA_RATING_DOMEN + '/rating/all/?limit=1000')
-    if page.status_code != 200:
+    page = CRAWLER.get(UA_RATING_DOMEN + '/rating/all/?limit=1000')
+    if not page or page.status_code != 200:
         return []
-    soup = BeautifulSoup(page.text, 'html.parser')
-    table = soup.find("table")
     ratings = []
-    for row in table.findAll("tr"):
-        cells = row.findAll("td")
+    for cells in html_tables.parse(page.text).rows():
         if len(cells) < 3:
             continue
-        href = cells[0].find('a').get('href')
-        date = cells[2].find(text=True)
+        href = cells[0].href
+        date = cells[2].text
         month, year = date.split('-')[1:]
         month = int(month)
         year = int(year)
@@ -124,325 +168,551 @@ def get_all_rating_lists():
     return ratings
 
 
-def parse_ua_all():
+def parse_ua_all(workers=None, resume=True):
+    """
+    Backfills all rating lists. Lists are processed in parallel workers,
+    progress of every list is stored in `RatingListIngest`, so with `resume`
+    lists completed by previous runs are skipped.
+    """
+    app = current_app._get_current_object()
+    workers = workers or app.config.get('BACKFILL_WORKERS', 4)
     rating_lists = get_all_rating_lists()
+    if not rating_lists:
+        return
+    latest_id = rating_lists[0][0]  # lists are ordered from the newest
+    if resume:
+        done = {i for i, in db.session.query(
+            RatingListIngest.rating_list_id).filter_by(
+            status=RatingListIngest.DONE)}
+        rating_lists = [r for r in rating_lists if str(r[0]) not in done]
+    LOG.info(f'Rating lists to parse: {len(rating_lists)}')
+
+    def parse(rating_id, year, month):
+        with app.app_context():
+            return _parse_ua_tracked(rating_id, year, month,
+                                     update_players=rating_id == latest_id)
+
     all_data = {'players': set(), 'cities': set(), 'tournaments': set(),
-                'was_updated': False}
-    for rating_id, year, month in rating_lists:
-        updated_data = parse_ua_by_external_id(rating_id, month, year)
-        if updated_data:
-            all_data['was_updated'] = True
-            all_data['players'].update(updated_data['players'])
-            all_data['cities'].update(updated_data['cities'])
-            all_data['tournaments'].update(updated_data['tournament'])
+                'was_updated': False, 'timings': {}}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parse, *r) for r in rating_lists]
+        for future in as_completed(futures):
+            rating_id, duration, updated_data = future.result()
+            all_data['timings'][rating_id] = duration
+            if updated_data:
+                all_data['was_updated'] = True
+                all_data['players'].update(updated_data['players'])
+                all_data['cities'].update(updated_data['cities'])
+                all_data['tournaments'].update(updated_data['tournaments'])
+    LOG.info(f'Parsed {len(all_data["timings"])} rating lists, total time '
+             f'{sum(all_data["timings"].values()):.1f} s')
     return all_data
 
 
+def _parse_ua_tracked(rating_id, year, month, update_players):
+    """Parses rating list recording progress in `RatingListIngest`."""
+    with WRITE_LOCK:
+        progress = RatingListIngest.query.get(str(rating_id)) or \
+                   RatingListIngest(rating_list_id=str(rating_id),
+                                    year=year, month=month)
+        progress.status = RatingListIngest.STARTED
+        progress.started_at = datetime.datetime.now()
+        progress.error = None
+        db.session.add(progress)
+        db.session.commit()
+    start = time.time()
+    updated_data = None
+    try:
+        updated_data = parse_ua_by_external_id(rating_id, month, year,
+                                               update_players=update_players)
+        progress.status = RatingListIngest.DONE
+    except Exception as e:
+        db.session.rollback()
+        progress.status = RatingListIngest.FAILED
+        progress.error = str(e)
+        LOG.error(f'Failed to parse rating list {rating_id}: {e}')
+    progress.finished_at = datetime.datetime.now()
+    progress.duration = time.time() - start
+    with WRITE_LOCK:
+        db.session.add(progress)
+        db.session.commit()
+    LOG.info(f'Rating list {rating_id} ({month}.{year}) {progress.status} '
+             f'in {progress.duration:.1f} s')
+    return rating_id, progress.duration, updated_data
+
+
 def _trim_city(city: str):
     if city.startswith('г.'):
         return city[2:].strip()
 
 
 def parse_ua_by_category(month, year, rating_id, category=Category.MEN,
-                         parse_tourn=True, previous_id=None):
+                         parse_tourn=True, previous_id=None,
+                         player_map=None, update_players=True):
     LOG.debug(
         f'Parsing rating: month = {month}, year = {year}, id = {rating_id}.')
-    updated_data = {'players': [], 'cities': [], 'tournaments': []}
-
-    cities = {c.name: c.name for c in City.query.all()}
-    new_cities = []
     male = 1 if category == Category.MEN else 2
     link = UA_RATING_T % (rating_id, male) if id else UA_RATING
-    page = requests.get(link)
-    if page.status_code != 200:
+    page = CRAWLER.get(link)
+    if not page or page.status_code != 200:
         return -1
     if int(page.url.rsplit('/', 3)[1]) == previous_id:
         return -1
-    soup = BeautifulSoup(page.text, 'html.parser')
-    table = soup.find("table", {"id": "sortTable"})
+    if getattr(page, 'unchanged', False) and Rating.query.join(
+            Player).filter(Rating.year == year, Rating.month == month,
+                           Player.category == category).first() and \
+            not Tournament.query.filter_by(rating_list_id=rating_id,
+                                           player_total=None).first():
+        LOG.info(f'{category} rating page is not changed. Skipping.')
+        return {'players': [], 'cities': [], 'tournaments': []}
+    try:
+        return _parse_rating_page(page, month, year, rating_id, category,
+                                  parse_tourn, player_map or PlayerMap(),
+                                  update_players=update_players)
+    except Exception:
+        if CRAWLER.cache:
+            CRAWLER.cache.forget(link)  # parse it again on next run
+        raise
+
+
+def _parse_rating_page(page, month, year, rating_id, category, parse_tourn,
+                       player_map, update_players=True):
+    updated_data = {'players': [], 'cities': [], 'tournaments': []}
+    doc = html_tables.parse(page.text)
     prev_position = 1
-    Player.query.filter_by(category=category).update(
-        {'prev_rating': Player.rating})
-    Player.query.filter_by(category=category).update({'rating': 0})
-    db.session.commit()
-    db.session.expire_all()
     players = []
-    for row in table.findAll("tr"):
-        cells = row.findAll("td")
+    for cells in doc.rows(id='sortTable'):
         if len(cells) < 6:
             continue
 
-        position = cells[0].find(text=True)
+        position = cells[0].text
         if not position:
             position = prev_position
         position = int(position)
 
         prev_position = position
-        name = cells[1].find(text=True)
-        href = cells[1].find('a').get('href')
+        name = cells[1].text
+        href = cells[1].href
         external_id = int(href.rsplit('/', 2)[1])
 
-        player = Player.query.filter_by(
-            external_id=external_id).first()
-        if not player:
-            player = Player()
-            updated_data['players'].append(name)
-
-        new_rating = float(cells[3].find(text=True).replace(',', '.'))
-        if player.rating != new_rating:
-            updated_data['players'].append(player.id)
-        player.rating = new_rating
-        player.rating_fine = float(cells[2].find(text=True).replace(',', '.'))
-        player.weight = int(cells[4].find(text=True))
-        player.year = int(cells[5].find(text=True) or 0)
-        city = cells[6].find(text=True)
+        player = {
+            'external_id': external_id,
+            'name': name,
+            'category': category,
+            'position': position,
+            'rating': float(cells[3].text.replace(',', '.')),
+            'fine_rating': float(
+                cells[2].text.replace(',', '.')),
+            'weight': int(cells[4].text),
+            'year': int(cells[5].text or 0),
+            'prev_rating': float(cells[7].text.replace(',', '.'))
+        }
+        city = cells[6].text
         locations = city.split('-')
-        player.city = locations[0]
-
+        player['city'] = locations[0]
         if len(locations) > 1:
-            player.city2 = locations[1]
-        player.prev_rating = float(cells[7].find(text=True).replace(',', '.'))
-
-        if not player.max or player.max < player.rating:
-            player.max = player.rating
-
-        player.name = name
-        player.category = category
-        player.external_id = external_id
-        player.position = position
-
-        locations = city.split('-')
-        player.city = locations[0]
-
-        if len(locations) > 1:
-            player.city2 = locations[1]
-
-        if not cities.get(player.city):
-            cities[player.city] = player.city
-            new_cities.append(player.city)
-            updated_data['cities'].append(player.city)
-
-        if player.city2 and not cities.get(player.city2):
-            cities[player.city2] = player.city2
-            new_cities.append(player.city2)
-            updated_data['cities'].append(player.city2)
+            player['city2'] = locations[1]
 
         players.append(player)
-        db.session.add(player)
 
-    db.session.commit()
-    for p in players:
-        p_rating = Rating.query.filter_by(
-            player_id=p.id, year=year, month=month).first() or Rating()
-        p_rating.player_id = p.id
-        p_rating.rating = p.rating
-        p_rating.weight = p.weight
-        p_rating.position = p.position
-        p_rating.month = month
-        p_rating.year = year
-        p_rating.rating_fine = p.fine_rating
-        db.session.add(p_rating)
-
-    for c in new_cities:
-        if not c:
-            continue
-        new_city = City()
-        new_city.name = c
-        db.session.add(new_city)
+    if not players:
+        LOG.error(f'No players found on rating page {page.url}')
+        return -1
 
-    db.session.commit()
+    with WRITE_LOCK:
+        updated_data['players'], updated_data['cities'] = _store_rating(
+            players, month, year, category, player_map, update_players)
 
     if parse_tourn:
         LOG.debug('Parsing tournaments...')
-        tourn_table = soup.find("table", {"id": "tourn-table"})
-        if tourn_table:
-            tournaments = []
-            for row in tourn_table.findAll("tr"):
-                try:
-                    cells = row.findAll("td")
-                    if len(cells) < 3:
-                        continue
-
-                    tourn_href = cells[0].find('a').get('href')
-                    name = cells[0].find(text=True)
-                    city = cells[1].find(text=True)
-                    judge = cells[2].find(text=True)
-                    if 'subtourn' in tourn_href:
-                        tourn_page = requests.get(UA_RATING_DOMEN + tourn_href)
-                        if tourn_page.status_code != 200:
-                            continue
-                        tourn_soup = BeautifulSoup(tourn_page.text,
-                                                   'html.parser')
-                        subtourn_table = tourn_soup.find("table",
-                                                         {"id": "sortTable"})
-                        for row in subtourn_table.findAll("tr"):
-                            try:
-                                cells = row.findAll("td")
-                                if len(cells) < 3:
-                                    continue
-                                sub_name = cells[0].find(text=True)
-                                sub_href = cells[0].find('a').get('href')
-                                tournament = Tournament()
-                                tournament.city = _trim_city(city)
-                                tournament.judge = judge
-                                tournament.name = name + " " + sub_name
-                                tourn_external_id = \
-                                    int(sub_href.rsplit('/', 2)[1])
-                                if Tournament.query.filter_by(
-                                        external_id=tourn_external_id).first():
-                                    LOG.debug('Tournament already exist')
-                                    continue
-                                updated_data['tournaments'].append(
-                                    tournament.name)
-                                tournament.external_id = tourn_external_id
-                                tournament.rating_list_id = rating_id
-                                parce_tournament_date(tournament)
-                                tournaments.append((tournament, sub_href))
-                                LOG.debug(f'--Parsed tournaments {tourn_href}')
-                            except Exception as e:
-                                LOG.debug(f'Failed to pasre tournaments. '
-                                          f'Rating id {rating_id}')
-                    else:
-                        tournament = Tournament()
-                        tournament.city = city
-                        tournament.judge = judge
-                        tournament.name = name
-                        tourn_external_id = int(tourn_href.rsplit('/', 2)[1])
-                        if Tournament.query.filter_by(
-                                external_id=tourn_external_id).first():
-                            LOG.debug('Tournament already exist')
-                            continue
-                        updated_data['tournaments'].append(
-                            tournament.name)
-                        tournament.external_id = tourn_external_id
-                        tournament.rating_list_id = rating_id
-                        parce_tournament_date(tournament)
-                        tournaments.append((tournament, tourn_href))
-                        LOG.debug(f'--Parsed tournaments {tourn_href}')
-                except Exception as e:
-                    LOG.debug(f'Failed to pasre tournaments. '
-                              f'Rating id {rating_id}. Reason {e}')
-
-            for tournament, _ in tournaments:
-                db.session.add(tournament)
-            db.session.commit()
-
-            for tournament, href in tournaments:
-                parse_tournament(href, tournament)
-            db.session.commit()
+        config = current_app.config
+        pipeline = Pipeline(config.get('PARSER_BATCH_SIZE', 1000), WRITE_LOCK)
+        tournaments = pipeline.stage('tournaments', _new_tournaments(
+            doc, rating_id, updated_data['tournaments']))
+        for batch in batched(tournaments,
+                             config.get('PARSER_TOURNAMENT_BATCH_SIZE', 20)):
+            with WRITE_LOCK:
+                for tournament, _ in batch:
+                    db.session.add(tournament)
+                db.session.flush()
+                batch = [(TournamentRef(t.id, t.start_date), href)
+                         for t, href in batch]
+                db.session.commit()
+            tourn_pages = pipeline.stage(
+                'tournament pages', CRAWLER.fetch_iter(
+                    UA_RATING_DOMEN + href + '?limit=1000'
+                    for _, href in batch))
+            parsed = [tournament.id for (tournament, href), tourn_page in
+                      zip(batch, tourn_pages)
+                      if parse_tournament(href, tournament, page=tourn_page,
+                                          player_map=player_map,
+                                          pipeline=pipeline)]
+            pipeline.flush()
+            _mark_parsed(parsed)
+        LOG.info(f'Tournaments of {category}: {pipeline}')
+        resolve_opponents(db.session.query(Tournament.id).filter_by(
+            rating_list_id=rating_id))
 
     return updated_data
 
 
-def parse_tournament(href, tournament):
-    page = requests.get(UA_RATING_DOMEN + href + '?limit=1000')
-    if page.status_code != 200:
-        return []
-    soup = BeautifulSoup(page.text, 'html.parser')
-    table = soup.find("table")
-    games = []
-    player_tourns = []
-    for row in table.findAll("tr"):
-        cells = row.findAll("td")
+def _mark_parsed(tournament_ids):
+    """
+    Sets `player_total` of tournaments whose games are stored, tournaments
+    without it are parsed again (see `_new_tournaments`).
+    """
+    if not tournament_ids:
+        return
+    total = db.session.query(func.count(PlayerTournament.player_id)).filter(
+        PlayerTournament.tournament_id == Tournament.id).as_scalar()
+    with WRITE_LOCK:
+        Tournament.query.filter(Tournament.id.in_(tournament_ids)).update(
+            {Tournament.player_total: total}, synchronize_session=False)
+        db.session.commit()
+
+
+def _new_tournaments(doc, rating_id, names):
+    """
+    Yields not stored tournaments of rating page as (Tournament, href),
+    names of them are added to `names`. Stored tournaments without
+    `player_total` were interrupted before all their games were written,
+    they are yielded again.
+    """
+    tourn_rows = []
+    for cells in doc.rows(id='tourn-table'):
+        try:
+            if len(cells) < 3:
+                continue
+            tourn_rows.append((cells[0].href, cells[0].text,
+                               cells[1].text, cells[2].text))
+        except Exception as e:
+            LOG.debug(f'Failed to pasre tournaments. '
+                      f'Rating id {rating_id}. Reason {e}')
+
+    # player_total of stored tournaments by external id, looked up only for
+    # tournaments of the page
+    existing_tourns = {}
+
+    def load_existing(hrefs):
+        ids = set()
+        for href in hrefs:
+            try:
+                ids.add(int(href.rsplit('/', 2)[1]))
+            except (AttributeError, IndexError, ValueError):
+                continue
+        ids.difference_update(existing_tourns)
+        for batch in batched(ids, 500):
+            existing_tourns.update(db.session.query(
+                Tournament.external_id, Tournament.player_total).filter(
+                Tournament.external_id.in_(batch)))
+
+    load_existing(href for href, *_ in tourn_rows if 'subtourn' not in href)
+    sub_pages = CRAWLER.fetch_iter(UA_RATING_DOMEN + href
+                                   for href, *_ in tourn_rows
+                                   if 'subtourn' in href)
+
+    def new_tournament(href, name, city, judge):
+        tourn_external_id = int(href.rsplit('/', 2)[1])
+        if tourn_external_id in existing_tourns:
+            if existing_tourns[tourn_external_id] is not None:
+                LOG.debug('Tournament already exist')
+                return None
+            LOG.info(f'Tournament {tourn_external_id} is not complete')
+            existing_tourns[tourn_external_id] = 0
+            return Tournament.query.filter_by(
+                external_id=tourn_external_id).one()
+        tournament = Tournament()
+        tournament.city = city
+        tournament.judge = judge
+        tournament.name = name
+        tournament.external_id = tourn_external_id
+        tournament.rating_list_id = rating_id
+        parce_tournament_date(tournament)
+        existing_tourns[tourn_external_id] = 0
+        names.append(tournament.name)
+        return tournament
+
+    for tourn_href, name, city, judge in tourn_rows:
+        if 'subtourn' in tourn_href:
+            tourn_page = next(sub_pages)
+            if not tourn_page or tourn_page.status_code != 200:
+                continue
+            sub_rows = [cells for cells in html_tables.parse(
+                tourn_page.text).rows(id='sortTable') if len(cells) >= 3]
+            load_existing(cells[0].href for cells in sub_rows)
+            for cells in sub_rows:
+                try:
+                    sub_href = cells[0].href
+                    tournament = new_tournament(
+                        sub_href, name + " " + cells[0].text,
+                        _trim_city(city), judge)
+                except Exception as e:
+                    LOG.debug(f'Failed to pasre tournaments. '
+                              f'Rating id {rating_id}')
+                    continue
+                if tournament:
+                    LOG.debug(f'--Parsed tournaments {tourn_href}')
+                    yield tournament, sub_href
+        else:
+            try:
+                tournament = new_tournament(tourn_href, name, city, judge)
+            except Exception as e:
+                LOG.debug(f'Failed to pasre tournaments. '
+                          f'Rating id {rating_id}. Reason {e}')
+                continue
+            if tournament:
+                LOG.debug(f'--Parsed tournaments {tourn_href}')
+                yield tournament, tourn_href
+
+
+def _store_rating(players, month, year, category, player_map,
+                  update_players=True):
+    """
+    Writes parsed rating table. With `update_players` off (historical
+    rating lists) only new players and ratings of the month are stored.
+    :return: updated players (names of new, ids of changed), new cities.
+    """
+    cities = {c for c, in db.session.query(City.name)}
+    new_cities = []
+    for p in players:
+        for c in (p['city'], p.get('city2')):
+            if c and c not in cities:
+                cities.add(c)
+                new_cities.append(c)
+
+    current = load_rows(db.session.query(
+        Player.id, *[getattr(Player, f) for f in PLAYER_FIELDS]).filter(
+        or_(Player.category == category, Player.category.is_(None))),
+        'external_id')
+    diff = Diff(current, players, 'external_id')
+    # players known from other categories or other sessions
+    new = [p for p in diff.new if p['external_id'] not in player_map]
+    changed = diff.changed + [dict(p, id=player_map.get(p['external_id']))
+                              for p in diff.new
+                              if p['external_id'] in player_map]
+    dropped = [{'id': p['id'], 'rating': 0, 'prev_rating': p['rating']}
+               for p in diff.dropped if p['category'] == category
+               and p['rating']]
+    updated_players = [p['name'] for p in new]
+    if update_players:
+        updated_players += [
+            p['id'] for p in changed
+            if 'rating' in diff.changed_fields.get(p['external_id'],
+                                                   {'rating'})]
+        bulk_update(Player, changed + dropped)
+        player_map.add(new)
+        Player.query.filter(
+            Player.category == category,
+            or_(Player.max.is_(None), Player.max < Player.rating)).update(
+            {'max': Player.rating}, synchronize_session=False)
+    else:
+        player_map.add([dict(p, rating=0) for p in new])
+    LOG.info(f'{category} players: {diff}')
+
+    ratings = [{
+        'player_id': player_map.get(p['external_id']),
+        'rating': p['rating'],
+        'weight': p['weight'],
+        'position': p['position'],
+        'month': month,
+        'year': year,
+        'rating_fine': p['fine_rating']
+    } for p in players]
+    current = load_rows(db.session.query(
+        Rating.id, *[getattr(Rating, f) for f in RATING_FIELDS]).filter_by(
+        year=year, month=month), 'player_id')
+    diff = Diff(current, ratings, 'player_id')
+    db.session.bulk_insert_mappings(Rating, diff.new)
+    bulk_update(Rating, diff.changed)
+    LOG.info(f'{category} ratings {year}.{month}: {diff}')
+
+    db.session.bulk_insert_mappings(City, [{'name': c} for c in new_cities])
+
+    db.session.commit()
+    return updated_players, new_cities
+
+
+def parse_tournament(href, tournament, page=None, player_map=None,
+                     pipeline=None):
+    """
+    Stores players and games of tournament page. Games are written by
+    batches of `pipeline`, which is flushed here unless it is given.
+    Players already stored in the tournament are skipped.
+    :return: True if the page was parsed.
+    """
+    if page is None:
+        page = CRAWLER.get(UA_RATING_DOMEN + href + '?limit=1000')
+    if not page or page.status_code != 200:
+        return False
+    player_map = player_map or PlayerMap()
+    own_pipeline = pipeline is None
+    if own_pipeline:
+        pipeline = Pipeline(current_app.config.get('PARSER_BATCH_SIZE', 1000),
+                            WRITE_LOCK)
+    stored = {i for i, in db.session.query(
+        Player.external_id).join(
+        PlayerTournament, PlayerTournament.player_id == Player.id).filter(
+        PlayerTournament.tournament_id == tournament.id)}
+    rows = []
+    for cells in html_tables.parse(page.text).rows():
         if len(cells) < 1:
             continue
-        href = cells[0].find('a').get('href')
+        href = cells[0].href
         external_id = int(href.rsplit('/', 2)[1])
-        player = Player.query.filter_by(external_id=external_id).first()
-        if not player:
-            player = Player()
-            player.name = cells[0].find(text=True)
-            parsed_player_info = parse_player(external_id)
-            if not parsed_player_info:
-                continue
-            city, year = parsed_player_info
-            player.city = city
-            player.year = year
-            player.external_id = external_id
-            db.session.add(player)
-            db.session.commit()
-        player_tourn = PlayerTournament()
-        player_tourn.player_id = player.id
-        player_tourn.tournament_id = tournament.id
-        player_tourn.start_rating = float(
-            cells[1].find(text=True).replace(',', '.'))
-        player_tourn.final_rating = float(
-            cells[5].find(text=True).replace(',', '.'))
-        player_tourn.start_weight = int(cells[2].find(text=True))
-        player_tourn.final_weight = int(cells[6].find(text=True))
-        player_tourn.delta_rating = float(
-            cells[3].find(text=True).replace(',', '.'))
-        player_tourn.delta_weight = int(cells[4].find(text=True))
-        player_games = parse_games(player, href, player_tourn.start_rating)
+        if external_id not in stored:
+            rows.append((cells, href, external_id))
+
+    # info of new players is needed before their games are stored
+    new_players = {external_id: cells[0].text
+                   for cells, _, external_id in rows
+                   if external_id not in player_map}
+    player_pages = pipeline.stage('player pages', CRAWLER.fetch_iter(
+        UA_RATING_DOMEN + f'/rating/p/1/{external_id}/'
+        for external_id in new_players))
+    players = []
+    for (external_id, name), player_page in zip(new_players.items(),
+                                                player_pages):
+        parsed_player_info = parse_player(external_id, page=player_page)
+        if not parsed_player_info:
+            continue
+        city, year = parsed_player_info
+        players.append({'external_id': external_id, 'name': name,
+                        'city': city, 'year': year})
+    with WRITE_LOCK:
+        player_map.add(players)
+        db.session.commit()
+
+    games_pages = pipeline.stage('games pages', CRAWLER.fetch_iter(
+        UA_RATING_DOMEN + href for _, href, _ in rows))
+    for (cells, href, external_id), games_page in zip(rows, games_pages):
+        player_id = player_map.get(external_id)
+        if not player_id:
+            continue
+        player_tourn = {
+            'player_id': player_id,
+            'tournament_id': tournament.id,
+            'start_rating': float(cells[1].text.replace(',', '.')),
+            'final_rating': float(cells[5].text.replace(',', '.')),
+            'start_weight': int(cells[2].text),
+            'final_weight': int(cells[6].text),
+            'delta_rating': float(cells[3].text.replace(',', '.')),
+            'delta_weight': int(cells[4].text)
+        }
+        player_games = parse_games(player_id, cells[0].text, href,
+                                   player_tourn['start_rating'],
+                                   player_map=player_map, page=games_page)
         for g in player_games:
-            g.date = tournament.start_date
-        games += player_games
-        player_tourn.game_total = len(player_games)
-        player_tourns.append(player_tourn)
-    for g in games:
-        g.tournament_id = tournament.id
-        db.session.add(g)
-    for p_t in player_tourns:
-        db.session.add(p_t)
-
-
-def parse_player(player_id):
+            g['date'] = tournament.start_date
+            g['tournament_id'] = tournament.id
+        player_tourn['game_total'] = len(player_games)
+        pipeline.write(Game, player_games)
+        pipeline.write(PlayerTournament, [player_tourn])
+    if own_pipeline:
+        pipeline.flush()
+        _mark_parsed([tournament.id])
+        resolve_opponents([tournament.id])
+    return True
+
+
+def resolve_opponents(tournament_ids=None):
+    """
+    Sets `Game.opponent_id` from `opponent_external_id` in one statement
+    for games whose opponent was not known when they were parsed.
+    :param tournament_ids: list or query of tournaments ids, all games
+    by default.
+    :return: number of resolved games.
+    """
+    query = Game.query.filter(
+        Game.opponent_id.is_(None),
+        Game.opponent_external_id.in_(db.session.query(Player.external_id)))
+    if tournament_ids is not None:
+        query = query.filter(Game.tournament_id.in_(tournament_ids))
+    opponent = db.session.query(Player.id).filter(
+        Player.external_id == Game.opponent_external_id).as_scalar()
+    with WRITE_LOCK:
+        resolved = query.update({Game.opponent_id: opponent},
+                                synchronize_session=False)
+        db.session.commit()
+    if resolved:
+        LOG.info(f'Resolved opponents of {resolved} games')
+    return resolved
+
+
+def repair_opponents():
+    """
+    Resolves missing opponents of all games. Games parsed before
+    `opponent_external_id` was stored are matched by opponent name if
+    only one player has this name.
+    :return: numbers of games resolved by external id and by name.
+    """
+    by_external_id = resolve_opponents()
+    unique_names = db.session.query(Player.name).group_by(
+        Player.name).having(func.count(Player.id) == 1)
+    opponent = db.session.query(Player.id).filter(
+        Player.name == Game.opponent_name).as_scalar()
+    with WRITE_LOCK:
+        by_name = Game.query.filter(
+            Game.opponent_id.is_(None),
+            Game.opponent_external_id.is_(None),
+            Game.opponent_name.in_(unique_names)).update(
+            {Game.opponent_id: opponent}, synchronize_session=False)
+        db.session.commit()
+    LOG.info(f'Repaired opponents: {by_external_id} by external id, '
+             f'{by_name} by name')
+    return by_external_id, by_name
+
+
+def parse_player(player_id, page=None):
     LOG.debug("Found not existing player, parsing new player")
-    page = requests.get(UA_RATING_DOMEN + f'/rating/p/1/{player_id}/')
-    if page.status_code != 200:
+    if page is None:
+        page = CRAWLER.get(UA_RATING_DOMEN + f'/rating/p/1/{player_id}/')
+    if not page or page.status_code != 200:
         return []
-    soup = BeautifulSoup(page.text, 'html.parser')
-    table = soup.find("table")
-    if not table:
+    rows = list(html_tables.parse(page.text).rows())
+    if len(rows) < 3:
         return None
-    row1, row2 = table.findAll("tr")[1:3]
-    city = row1.findAll("td")[1].find(text=True)
-    year = row2.findAll("td")[1].find(text=True)
+    row1, row2 = rows[1:3]
+    city = row1[1].text
+    year = row2[1].text
     if not year:
         year = 0
     return city, int(year)
 
 
-def parse_games(player, player_href, start_rating):
+def parse_games(player_id, player_name, player_href, start_rating,
+                player_map=None, page=None):
     LOG.debug(f'----Parse games {player_href}')
     games = []
-    page = requests.get(UA_RATING_DOMEN + player_href)
-    if page.status_code != 200:
-        return []
-    soup = BeautifulSoup(page.text, 'html.parser')
-    if not player:
+    if page is None:
+        page = CRAWLER.get(UA_RATING_DOMEN + player_href)
+    if not page or page.status_code != 200:
         return []
-    table = soup.find("table", {'class': 'striped'})
-    if not table:
-        return []
-    for row in table.findAll("tr"):
-        cells = row.findAll("td")
+    player_map = player_map or PlayerMap()
+    for cells in html_tables.parse(page.text).rows(cls='striped'):
         if len(cells) < 1:
             continue
-        oponent_name = cells[2].find(text=True)
-        contribution = cells[4].find(text=True)
-        oponent_rating = cells[3].find(text=True)
-        o_href = cells[2].find('a')
+        oponent_name = cells[2].text
+        contribution = cells[4].text
+        oponent_rating = cells[3].text
+        o_href = cells[2].href
         if o_href:
-            o_href = o_href.get('href')
             oponent_external_id = int(o_href.rsplit('/', 2)[1])
         else:
-            oponent_external_id = -1
-        result = cells[1].find(text=True)
+            oponent_external_id = None
+        result = cells[1].text
         result = False if result == u'проиграл' else True
-        game = Game()
-        game.player_id = player.id
-        game.player_name = player.name
-        oponent = Player.query.filter_by(
-            external_id=oponent_external_id).first()
-        game.opponent_name = oponent_name
-        if oponent:
-            game.opponent_id = oponent.id
-        game.result = result
-        game.contribution = int(contribution)
-        game.opponent_rating = float(oponent_rating.replace(',', '.'))
-        game.player_rating = start_rating
-        games.append(game)
+        games.append({
+            'player_id': player_id,
+            'player_name': player_name,
+            # opponents parsed later are resolved by `resolve_opponents`
+            'opponent_id': player_map.get(oponent_external_id),
+            'opponent_external_id': oponent_external_id,
+            'opponent_name': oponent_name,
+            'result': result,
+            'contribution': int(contribution),
+            'opponent_rating': float(oponent_rating.replace(',', '.')),
+            'player_rating': start_rating
+        })
     return games
 
 
@@ -525,9 +795,130 @@ def parse_tt_cup_photos():
         json.dump(players_data, f)
 
 
-def parse_world_rating_all():
-    raise NotImplemented
+def parse_world_rating_all(start_year=None):
+    """
+    Stores all not stored world rating lists since `start_year`.
+    :return: True if any rating list was stored.
+    """
+    today = datetime.date.today()
+    start_year = start_year or current_app.config.get(
+        'WORLD_RATING_START_YEAR', 2001)
+    existing = {i for i, in db.session.query(WorldRatingList.id)}
+    months = [(year, month) for year in range(start_year, today.year + 1)
+              for month in range(1, 13)
+              if (year, month) <= (today.year, today.month) and
+              f'{year}_{month}' not in existing]
+    return _parse_world_months(months)
 
 
 def parse_world_rating():
-    raise NotImplemented
\ No newline at end of file
+    """
+    Stores world rating list of the current or of the previous month.
+    :return: True if a new rating list was stored.
+    """
+    today = datetime.date.today()
+    previous = today.replace(day=1) - datetime.timedelta(days=1)
+    existing = {i for i, in db.session.query(WorldRatingList.id)}
+    months = [(d.year, d.month) for d in (previous, today)
+              if f'{d.year}_{d.month}' not in existing]
+    return _parse_world_months(months)
+
+
+def _world_rating_files(months):
+    """
+    Yields (year, month, category, contents) of world rating XLS files,
+    contents is None if there is no file. Files are read from
+    WORLD_RATING_FIXTURES directory instead of ITTF site if it is set.
+    """
+    files = [(year, month, category, WORLD_RATING % (year, month, code))
+             for year, month in months
+             for category, code in WORLD_CATEGORIES.items()]
+    fixtures = current_app.config.get('WORLD_RATING_FIXTURES')
+    if fixtures:
+        for year, month, category, url in files:
+            path = os.path.join(fixtures, url.rsplit('/', 1)[1])
+            contents = None
+            if os.path.exists(path):
+                with open(path, 'rb') as f:
+                    contents = f.read()
+            yield year, month, category, contents
+        return
+    pages = CRAWLER.fetch_iter(url for *_, url in files)
+    for (year, month, category, _), page in zip(files, pages):
+        found = page is not None and page.status_code == 200
+        yield year, month, category, page.content if found else None
+
+
+def _parse_world_months(months):
+    """Stores world rating lists of months, returns True if any is stored."""
+    latest = db.session.query(WorldRatingList.year,
+                              WorldRatingList.month).order_by(
+        WorldRatingList.year.desc(), WorldRatingList.month.desc()).first()
+    player_maps = {c: WorldPlayerMap(c) for c in WORLD_CATEGORIES}
+    countries = {c for c, in db.session.query(Country.code)}
+    stored = False
+    files = groupby(_world_rating_files(sorted(months)),
+                    key=lambda f: f[:2])
+    for (year, month), month_files in files:
+        # players keep rating of the latest list
+        update_players = not latest or (year, month) >= tuple(latest)
+        players = 0
+        try:
+            for _, _, category, contents in month_files:
+                if contents is None:
+                    continue
+                players += _store_world_rating(
+                    world_rating.read_rows(contents), year, month,
+                    player_maps[category], countries, update_players)
+        except Exception as e:
+            db.session.rollback()
+            LOG.error(f'Failed to parse world rating {year}.{month}: {e}')
+            # ids of rolled back players are not valid anymore
+            player_maps = {c: WorldPlayerMap(c) for c in WORLD_CATEGORIES}
+            countries = {c for c, in db.session.query(Country.code)}
+            continue
+        if not players:
+            LOG.debug(f'No world rating for {year}.{month}')
+            continue
+        db.session.add(WorldRatingList(id=f'{year}_{month}', year=year,
+                                       month=month))
+        db.session.commit()
+        stored = True
+        LOG.info(f'World rating {year}.{month}: {players} players')
+    return stored
+
+
+def _store_world_rating(rows, year, month, player_map, countries,
+                        update_players=True):
+    """
+    Writes rows of a world rating file by batches, without commit.
+    :return: number of stored ratings.
+    """
+    count = 0
+    for batch in batched(rows, current_app.config.get('PARSER_BATCH_SIZE',
+                                                      1000)):
+        new_countries = {r['country'] for r in batch} - countries
+        db.session.bulk_insert_mappings(Country, [
+            {'code': c, 'name': c} for c in new_countries])
+        countries.update(new_countries)
+
+        existing = [r for r in batch
+                    if (r['name'], r['country']) in player_map]
+        player_map.add([{'name': r['name'], 'country_code': r['country'],
+                         'rating': r['rating'], 'position': r['position']}
+                        for r in batch])
+        if update_players:
+            bulk_update(WorldPlayer, [{
+                'id': player_map.get((r['name'], r['country'])),
+                'rating': r['rating'],
+                'position': r['position']
+            } for r in existing])
+        db.session.bulk_insert_mappings(WorldRating, [{
+            'player_id': player_map.get((r['name'], r['country'])),
+            'position': r['position'],
+            'rating': r['rating'],
+            'year': year,
+            'month': month
+        } for r in batch])
+        count += len(batch)
+    return count
@@ -0,0 +1,87 @@
+"""
+Helpers for streaming ingestion: stages are generators connected one to
+another, rows are written by batches, so memory doesn't depend on the size
+of the ingested data. `Pipeline` counts items and time of every stage.
+"""
+import time
+from itertools import islice
+
+from models import db
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Pipeline:
+    def __init__(self, batch_size=1000, lock=None):
+        """
+        :param batch_size: rows per bulk insert.
+        :param lock: lock held while writing a batch.
+        """
+        self.batch_size = batch_size
+        self.lock = lock
+        self.items = {}
+        self.time = {}
+        self._rows = {}
+
+    def _count(self, name, items, elapsed):
+        self.items[name] = self.items.get(name, 0) + items
+        self.time[name] = self.time.get(name, 0) + elapsed
+
+    def stage(self, name, iterable):
+        """Passes items through counting them and time spent on them."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._count(name, 0, time.perf_counter() - start)
+            self._count(name, 1, 0)
+            yield item
+
+    def write(self, model, rows):
+        """Adds rows of model to the batch, writes full batches."""
+        batch = self._rows.setdefault(model, [])
+        batch.extend(rows)
+        if len(batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes pending rows of all models in one transaction, models are
+        written in the order their rows were added, so rows written after
+        the rows they depend on are never stored without them.
+        """
+        if not any(self._rows.values()):
+            return
+        if self.lock:
+            with self.lock:
+                self._write()
+        else:
+            self._write()
+
+    def _write(self):
+        rows, self._rows = self._rows, {}
+        for model, model_rows in rows.items():
+            if not model_rows:
+                continue
+            start = time.perf_counter()
+            db.session.bulk_insert_mappings(model, model_rows)
+            self._count(f'{model.__name__} insert', len(model_rows),
+                        time.perf_counter() - start)
+        db.session.commit()
+
+    def __str__(self):
+        return ', '.join(
+            f'{name}: {self.items[name]} in {self.time[name]:.2f} s'
+            f' ({self.items[name] / (self.time[name] or 1):.0f}/s)'
+            for name in self.items)
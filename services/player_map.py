@@ -0,0 +1,44 @@
+"""
+Ingestion-scoped identity map of players.
+Loads `external_id -> Player.id` once and inserts missing players in batches,
+so parsing doesn't query the player table once per table row.
+"""
+from models import db, Player
+
+CHUNK_SIZE = 500  # max number of bound parameters in one IN clause
+
+
+class PlayerMap:
+    def __init__(self):
+        self.ids = dict(db.session.query(Player.external_id, Player.id).filter(
+            Player.external_id.isnot(None)))
+
+    def __contains__(self, external_id):
+        return external_id in self.ids
+
+    def get(self, external_id):
+        return self.ids.get(external_id)
+
+    def load(self, external_ids):
+        """Maps ids of players stored by other sessions, returns missing."""
+        external_ids = [i for i in set(external_ids) if i not in self.ids]
+        for i in range(0, len(external_ids), CHUNK_SIZE):
+            chunk = external_ids[i:i + CHUNK_SIZE]
+            self.ids.update(db.session.query(
+                Player.external_id, Player.id).filter(
+                Player.external_id.in_(chunk)))
+        return [i for i in external_ids if i not in self.ids]
+
+    def add(self, players):
+        """
+        Bulk inserts not mapped players.
+        :param players: list of dicts with Player columns, `external_id` is
+        required.
+        """
+        players = {p['external_id']: p for p in players
+                   if p['external_id'] not in self.ids}
+        missing = self.load(players.keys())
+        if not missing:
+            return
+        db.session.bulk_insert_mappings(Player, [players[i] for i in missing])
+        self.load(missing)
@@ -0,0 +1,52 @@
+"""
+Diff of an incoming rating table against the rows currently stored in DB.
+Used by the parser to write only rows that actually changed instead of
+rewriting the whole table on every ingest.
+"""
+from models import db
+
+BATCH_SIZE = 1000
+
+
+class Diff:
+    def __init__(self, current, incoming, key):
+        """
+        :param current: {key: row dict with `id`} - rows stored in DB.
+        :param incoming: iterable of row dicts from the parsed page.
+        :param key: name of the field rows are matched by.
+        """
+        self.new = []
+        self.changed = []
+        self.changed_fields = {}
+        self.unchanged = 0
+        seen = set()
+        for row in incoming:
+            seen.add(row[key])
+            stored = current.get(row[key])
+            if not stored:
+                self.new.append(row)
+                continue
+            fields = {f for f, v in row.items() if stored.get(f) != v}
+            if fields:
+                self.changed.append(dict(row, id=stored['id']))
+                self.changed_fields[row[key]] = fields
+            else:
+                self.unchanged += 1
+        self.dropped = [row for k, row in current.items() if k not in seen]
+
+    def counts(self):
+        return {'new': len(self.new), 'changed': len(self.changed),
+                'unchanged': self.unchanged, 'dropped': len(self.dropped)}
+
+    def __str__(self):
+        return ', '.join(f'{k}: {v}' for k, v in self.counts().items())
+
+
+def load_rows(query, key):
+    """Loads query result as {row[key]: row dict}."""
+    return {row[key]: row for row in (r._asdict() for r in query)}
+
+
+def bulk_update(model, rows, batch_size=BATCH_SIZE):
+    for i in range(0, len(rows), batch_size):
+        db.session.bulk_update_mappings(model, rows[i:i + batch_size])
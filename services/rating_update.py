@@ -6,45 +6,59 @@ Module contains tasks for ranking data update:
     - Update player statistics.
     - Send email reports.
 """
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
 from time import time
-from models import db, User, Game, Player, Tournament
+from sqlalchemy import Integer, cast, distinct, func
+from models import db, DagRun, User, Game, Player, Tournament
 from flask_mail import Message
 from app import mail
 from flask import request
 from flask_babel import _
 from flask import render_template
-from app import app, cache, mail_alert
+from app import app, forget_translations, mail_alert
 from itsdangerous import URLSafeSerializer
 from views import common
-from services import parser, translator, statistics, email_reports, games_chain
+from services import (parser, translator, statistics, email_reports,
+                      games_chain, job_runs, cache_warming)
+from services.pipeline import batched
 
 
 def update_ua(raises=False):
     success = True
+    started_at = datetime.now()
     updated_data = parser.parse_ua()
     if not updated_data:
         return
-    translate_new_strings(updated_data, raises=raises)
-    update_statistics(raises=raises)
+    steps = [(translate_new_strings, updated_data), (update_statistics,),
+             (update_graph_for_games_chain,), (invalidate_cache, started_at),
+             (warm_cache,)]
     if updated_data.get('new'):
-        send_ua_monthly_report(raises=raises)
+        steps.append((send_ua_monthly_report,))
         mail_alert(f'New rating. Updated data: {updated_data}')
     else:
         mail_alert(f'Rating updated. Updated data: {updated_data}')
     if updated_data.get('players'):
-        send_rating_update_report(updated_data['players'])
-    update_graph_for_games_chain(raises=raises)
-    cache.clear()
+        steps.append((send_rating_update_report, updated_data['players']))
+    run_dag('Update UA rating', steps, raises=raises)
     return success
 
 
 def update_world():
     if parser.parse_world_rating():
+        common.invalidate(common.WORLD)
         send_world_monthly_report()
 
 
-def subtask(name):
-    """Wraps a func in 'try except' block and log result."""
+def subtask(name, depends=(), always=False, writes=False):
+    """
+    Wraps a func in 'try except' block and log result.
+    :param depends: subtasks which must succeed before this one in
+    `run_dag`.
+    :param always: run after `depends` finish even if they failed.
+    :param writes: hold `parser.WRITE_LOCK` while running, SQLite allows
+    only one writer, so subtasks writing to DB run one at a time.
+    """
 
     def wrapper(f):
         def wrapped(*args, **kwargs):
@@ -52,7 +66,12 @@ def subtask(name):
             try:
                 start = time()
                 app.logger.info(f'Task "{name}" started')
-                result = f(*args, **kwargs)
+                with job_runs.record(name):
+                    if writes:
+                        with parser.WRITE_LOCK:
+                            result = f(*args, **kwargs)
+                    else:
+                        result = f(*args, **kwargs)
                 end = time()
                 app.logger.info(f'Task "{name}" finished. Time: {end-start}')
                 return result
@@ -61,35 +80,140 @@ def subtask(name):
                 if raises:
                     raise
 
+        wrapped.name = name
+        wrapped.depends = depends
+        wrapped.always = always
         return wrapped
 
     return wrapper
 
 
+def _run_step(step, args, counters):
+    """
+    Runs subtask in its own app context, returns its timeline entry. Rows
+    it writes are counted in job `counters` of the calling thread.
+    """
+    with app.app_context(), job_runs.inherit(counters):
+        entry = {'name': step.name, 'start': str(datetime.now())}
+        try:
+            step(*args, raises=True)
+            entry['status'] = DagRun.DONE
+        except Exception as e:
+            entry['status'] = DagRun.FAILED
+            entry['error'] = str(e)
+        entry['end'] = str(datetime.now())
+        return entry
+
+
+def run_dag(name, steps, raises=False, workers=None):
+    """
+    Runs subtasks concurrently, every one as soon as its dependencies among
+    `steps` succeed. Subtasks with failed dependencies are skipped, unless
+    they run `always`.
+    Timeline of the run is stored in `DagRun`.
+    :param steps: list of `(subtask, *args)` tuples.
+    """
+    run = DagRun(name=name, status=DagRun.RUNNING,
+                 started_at=datetime.now())
+    db.session.add(run)
+    db.session.commit()
+    start = time()
+    args = {step: step_args for step, *step_args in steps}
+    counters = job_runs.current()
+    entries = {}
+    running = {}
+    with ThreadPoolExecutor(workers or app.config.get('DAG_WORKERS', 4)) \
+            as executor:
+        while len(entries) < len(args):
+            for step in args:
+                if step in entries or step in running.values():
+                    continue
+                depends = [d for d in step.depends if d in args]
+                if not step.always and any(
+                        d in entries and entries[d]['status'] != DagRun.DONE
+                        for d in depends):
+                    entries[step] = {'name': step.name,
+                                     'status': DagRun.SKIPPED}
+                elif all(d in entries for d in depends):
+                    running[executor.submit(
+                        _run_step, step, args[step], counters)] = step
+            if not running:  # left steps depend on skipped ones or cycle
+                for step in args:
+                    entries.setdefault(step, {'name': step.name,
+                                              'status': DagRun.SKIPPED})
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                entries[running.pop(future)] = future.result()
+    run.timeline = [entries[step] for step in args]
+    failed = [e for e in run.timeline if e['status'] != DagRun.DONE]
+    run.status = DagRun.FAILED if failed else DagRun.DONE
+    run.finished_at = datetime.now()
+    run.duration = time() - start
+    db.session.commit()
+    app.logger.info(f'{name} finished in {run.duration:.1f} s: ' + ', '.join(
+        f'{e["name"]} {e["status"]}' for e in run.timeline))
+    if raises and failed:
+        raise RuntimeError(f'{name} failed: {failed}')
+    return run
+
+
 @subtask('Update graph for games chain')
 def update_graph_for_games_chain():
     games_chain.update_graphs()
 
 
-@subtask('Translate new strings')
+@subtask('Translate new strings', writes=True)
 def translate_new_strings(updated_data):
     translator.add_translations(updated_data['players'], 'ua')
     translator.add_translations(updated_data['cities'], 'ua')
     translator.add_translations(updated_data['tournaments'], 'ua')
 
 
-@subtask('Update statistics')
+@subtask('Update statistics', writes=True)
 def update_statistics():
     update_player_stats()
     statistics.calculate()
 
 
+@subtask('Invalidate cache', depends=(translate_new_strings,
+                                      update_statistics,
+                                      update_graph_for_games_chain),
+         always=True)
+def invalidate_cache(since):
+    """
+    Invalidates pages of the current rating list, its tournaments and
+    players updated since the update started (ratings, dropped players,
+    recounted stats), other cached pages stay, and memoized translations
+    of names. Runs when other updates finish even if they failed,
+    ingested data is shown anyway.
+    """
+    forget_translations()
+    current_rating = common.get_current_rating_list()
+    tournaments = db.session.query(Tournament.id).filter_by(
+        rating_list_id=current_rating.id)
+    players = db.session.query(Player.id).filter(Player.updated_at >= since)
+    common.invalidate(
+        common.UA, common.UA_LIST,
+        *[common.tournament_namespace(id) for id, in tournaments],
+        *[common.player_namespace(id) for id, in players])
+
+
+@subtask('Warm cache', depends=(invalidate_cache,))
+def warm_cache():
+    """Renders hot pages, so visitors get the new data from cache."""
+    report = cache_warming.warm()
+    if report['failed']:
+        # pages are rendered on visit anyway, the update is not failed
+        app.logger.warning(f'Cache warming failed for {report["failed"]}')
+
+
 def generate_confirmation_token(email):
     serializer = URLSafeSerializer(app.config['SECRET_KEY'])
     return serializer.dumps(email, salt=app.config['SECURITY_PASSWORD_SALT'])
 
 
-@subtask('Send ua rating reports')
+@subtask('Send ua rating reports', depends=(translate_new_strings,))
 def send_ua_monthly_report():
     report = email_reports.generate_ua_monthly_report()
     users = User.query.filter_by(confirmed=True).all()
@@ -111,7 +235,7 @@ def send_ua_monthly_report():
                     conn.send(msg)
 
 
-@subtask('Send ua rating updates reports')
+@subtask('Send ua rating updates reports', depends=(translate_new_strings,))
 def send_rating_update_report(updated_players):
     users = User.query.filter(
         User.confirmed == True,
@@ -156,34 +280,34 @@ def send_world_monthly_report():
                     conn.send(msg)
 
 
-@subtask('Update player stats for last month')
+@subtask('Update player stats', writes=True)
 def update_player_stats(update_all=False):
+    """
+    Recounts games, won games and tournaments of players from all their
+    games, so reruns don't change the result. By default only players of
+    the current rating list are recounted, with `update_all` all players.
+    """
     app.logger.info('Updating players info...')
-    players = Player.query.filter(Player.rating != 0).all()
-    current_rating = common.get_current_rating_list()
-
+    stats = db.session.query(
+        Game.player_id, func.count(Game.id),
+        func.coalesce(func.sum(cast(Game.result, Integer)), 0),
+        func.count(distinct(Game.tournament_id))).filter(
+        Game.player_id.isnot(None)).group_by(Game.player_id)
     if update_all:
-        Player.query.update(tournaments_total=0, game_total=0, game_won=0)
-        tournaments = Tournament.query.all()
+        Player.query.update({'tournaments_total': 0, 'game_total': 0,
+                             'game_won': 0}, synchronize_session=False)
     else:
-        tournaments = Tournament.query.filter_by(
-            rating_list_id=current_rating.id).all()
-
-    for tournament in tournaments:
-        app.logger.debug(f'Processing tournament {tournament.name}')
-        games = Game.query.filter_by(tournament_id=tournament.id).all()
-        player_games = {}
-        for g in games:
-            if not player_games.get(g.player_id):
-                player_games[g.player_id] = list()
-            player_games[g.player_id].append(g)
-        for p in players:
-            if not player_games.get(p.id):
-                continue
-            won = [g for g in player_games[p.id] if g.result]
-            tourns = set([g.tournament_id for g in player_games[p.id]])
-            p.game_total += len(player_games[p.id])
-            p.game_won += len(won)
-            p.tournaments_total += len(tourns)
-            db.session.add(p)
+        current_rating = common.get_current_rating_list()
+        players = db.session.query(Game.player_id).join(Tournament).filter(
+            Tournament.rating_list_id == current_rating.id)
+        stats = stats.filter(Game.player_id.in_(players.subquery()))
+
+    total = 0
+    for rows in batched(stats, app.config.get('PARSER_BATCH_SIZE', 1000)):
+        db.session.bulk_update_mappings(Player, [
+            {'id': player_id, 'game_total': game_total,
+             'game_won': game_won, 'tournaments_total': tournaments_total}
+            for player_id, game_total, game_won, tournaments_total in rows])
+        total += len(rows)
     db.session.commit()
+    app.logger.info(f'Updated stats of {total} players')
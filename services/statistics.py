@@ -1,12 +1,18 @@
 import sys
+import json
+import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from sqlalchemy import extract
+import numpy as np
+from sqlalchemy import func
 from flask import current_app
 
 import models
-from models import db, Topic, Player, Tournament, Game,RatingList, Rating
-from views import common
+from models import db, Topic, TopicIssue, Player, Game
+from services import analytics
+from services.analytics import (RATING_LISTS, RATINGS, TOURNAMENTS, GAMES,
+                                PLAYERS)
 
 
 class Type:
@@ -21,6 +27,7 @@ class Period():
 
 
 PROCESSORS = {}
+DEPENDS = {}  # processor -> sources
 
 
 def set_date(topic_issue, date):
@@ -37,11 +44,25 @@ def set_date(topic_issue, date):
                                                 day=1)
 
 
-def topic_processor(func):
-    PROCESSORS[func.__name__] = func
+def topic_processor(*depends):
+    """Registers processor, which data depends only on `depends` sources."""
+    def register(func):
+        PROCESSORS[func.__name__] = func
+        DEPENDS[func.__name__] = depends
+        return func
+    return register
 
 
-@topic_processor
+def _by_ids(model, ids):
+    """Rows of model with ids in the order of ids, in one query."""
+    ids = [int(i) for i in ids]
+    if not ids:
+        return []
+    rows = {row.id: row for row in model.query.filter(model.id.in_(ids))}
+    return [rows[i] for i in ids if i in rows]
+
+
+@topic_processor(PLAYERS)
 def top_rating_list(props):
     year = datetime.date.today().year
     headers = ['Гравець', 'Рейтинг', 'Вага', 'Рік', 'Місто']
@@ -65,13 +86,16 @@ def top_rating_list(props):
     return dict(headers=headers, data=data)
 
 
-@topic_processor
+@topic_processor(GAMES, TOURNAMENTS)
 def top_win(props):
     headers = ['Гравець', 'Рейтинг', 'Суперник', 'Рейтинг суперника',
                'Вклад']
-    games = models.Game.query.join(models.Tournament).filter(
-        models.Game.opponent_rating > props['rating_limit']).order_by(
-        models.Game.contribution.desc()).limit(props['count']).all()
+    games = analytics.snapshot()[GAMES]
+    tournaments = analytics.snapshot()[TOURNAMENTS]
+    mask = (games['opponent_rating'] > props['rating_limit']) & np.isin(
+        games['tournament_id'], tournaments['id'])
+    top = analytics.top_k(games['contribution'], props['count'], mask)
+    games = _by_ids(Game, games['id'][top])
     data = [{
         'Гравець': {
             'text': g.player_name,
@@ -92,7 +116,7 @@ def top_win(props):
     return dict(data=data, headers=headers)
 
 
-@topic_processor
+@topic_processor(PLAYERS)
 def top_total(props):
     order = props.get('order', 'desc')
     criteria = getattr(getattr(models.Player, props['field']), order)()
@@ -114,7 +138,7 @@ def top_total(props):
     return dict(headers=headers, data=data)
 
 
-@topic_processor
+@topic_processor(PLAYERS)
 def top_player_age(props):
     order = props.get('order', 'desc')
     player_infos = models.Player.query.order_by(
@@ -134,15 +158,15 @@ def top_player_age(props):
     return dict(headers=headers, data=data)
 
 
-@topic_processor
+@topic_processor(PLAYERS)
 def top_winner(props):
     min_game_total = props['min_game_total']
     count = props['count']
-    player_infos = models.Player.query.filter(
-        models.Player.game_total > min_game_total).all()
-
-    top_list = sorted(player_infos, key=lambda x: float(
-        x.game_won) / x.game_total, reverse=True)[:count]
+    players = analytics.snapshot()[PLAYERS]
+    mask = players['game_total'] > min_game_total
+    win_rate = players['game_won'] / np.maximum(players['game_total'], 1)
+    top_list = _by_ids(Player, players['id'][
+        analytics.top_k(win_rate, count, mask)])
 
     headers = ['Гравець', 'Перемога', 'Поразка', 'Рік', 'Місто']
     data = [{
@@ -159,57 +183,48 @@ def top_winner(props):
     return dict(headers=headers, data=data)
 
 
-@topic_processor
+@topic_processor(RATING_LISTS, RATINGS)
 def rating_dynamics(props):
     rating_limit = props['rating_limit']
     label = 'Кількість гравців'
-    rating_lists = models.RatingList.query.order_by('year', 'month').all()
-    x = []
-    y = [f'{r.month:0>2} {r.year}' for r in rating_lists]
-    for r in rating_lists:
-        player60_count = models.Rating.query.filter(
-            models.Rating.rating > rating_limit,
-            models.Rating.year == r.year,
-            models.Rating.month == r.month).count()
-        x.append(player60_count)
+    rating_lists = analytics.snapshot()[RATING_LISTS]
+    ratings = analytics.snapshot()[RATINGS]
+    order = np.lexsort((rating_lists['month'], rating_lists['year']))
+    years = rating_lists['year'][order]
+    months = rating_lists['month'][order]
+    x = analytics.count_of(ratings['year'] * 100 + ratings['month'],
+                           years * 100 + months,
+                           ratings['rating'] > rating_limit).tolist()
+    y = [f'{month:0>2} {year}' for year, month in zip(years, months)]
     return dict(label=label, x=x, y=y)
 
 
-@topic_processor
+@topic_processor(RATING_LISTS, TOURNAMENTS)
 def tournament_dynamics_by_year(props):
     city = props.get('city')
     label = 'Кількість турнірів'
-    rating_lists = models.RatingList.query.all()
-    years = set()
-    for l in rating_lists:
-        years.add(l.year)
-    x = []
-    years = sorted(list(years))
-    for y in years:
-        if city:
-            total = models.Tournament.query.filter(
-                extract('year', models.Tournament.start_date) == y).filter_by(
-                city=city).count()
-        else:
-            total = models.Tournament.query.filter(
-                extract('year', models.Tournament.start_date) == y).count()
-        x.append(total)
-    return dict(label=label, x=x, y=years)
-
-
-@topic_processor
+    tournaments = analytics.snapshot()[TOURNAMENTS]
+    years = np.unique(analytics.snapshot()[RATING_LISTS]['year'])
+    mask = tournaments['city'] == city if city else None
+    x = analytics.count_of(tournaments['year'], years, mask).tolist()
+    return dict(label=label, x=x, y=years.tolist())
+
+
+def _top_counts(column, count):
+    """
+    Most frequent values of tournaments column with their counts and total
+    number of tournaments.
+    """
+    values = analytics.snapshot()[TOURNAMENTS][column]
+    found, counts = analytics.group_count(values)
+    top = analytics.top_k(counts, count or len(counts))
+    return [(found[i] or None, int(counts[i])) for i in top], len(values)
+
+
+@topic_processor(TOURNAMENTS)
 def tournament_dynamics_by_city(props):
-    count = props.get('count')
-    tournaments = models.Tournament.query.all()
     label = 'Кількість турнірів'
-    city_totals = {}
-    for t in tournaments:
-        city_totals[t.city] = city_totals.get(t.city, 0) + 1
-
-    city_totals_sorted = sorted(city_totals.items(), key=lambda x: x[1],
-                                reverse=True)
-    top_totals = city_totals_sorted[:count]
-    other_total = sum([x[1] for x in city_totals_sorted])
+    top_totals, other_total = _top_counts('city', props.get('count'))
     x = []
     y = []
     for i in top_totals:
@@ -221,17 +236,9 @@ def tournament_dynamics_by_city(props):
     return dict(label=label, x=x, y=y)
 
 
-@topic_processor
+@topic_processor(TOURNAMENTS)
 def most_active_judges(props):
-    count = props.get('count')
-    tournaments = models.Tournament.query.all()
-    judges_totals = {}
-    for t in tournaments:
-        judges_totals[t.judge] = judges_totals.get(t.judge, 0) + 1
-
-    judges_totals_sorted = sorted(judges_totals.items(), key=lambda x: x[1],
-                                  reverse=True)
-    top_totals = judges_totals_sorted[:count]
+    top_totals, _ = _top_counts('judge', props.get('count'))
     headers = ['Суддя', 'Кількість турнірів']
     data = [{'Суддя': k,
              'Кількість турнірів': v}
@@ -240,30 +247,34 @@ def most_active_judges(props):
     return dict(headers=headers, data=data)
 
 
-@topic_processor
+@topic_processor(RATING_LISTS, TOURNAMENTS, GAMES, RATINGS)
 def last_ranking_total(props=None):
-    current_rating = common.get_current_rating_list()
-    tournament_ids = [t.id for t in current_rating.tournaments]
-    game_total = models.Game.query.filter(
-        models.Game.tournament_id.in_(tournament_ids)).count()
-    player_total = models.Rating.query.filter_by(
-        month=current_rating.month, year=current_rating.year).count()
+    snapshot = analytics.snapshot()
+    rating_lists = snapshot[RATING_LISTS]
+    current = np.lexsort((rating_lists['month'], rating_lists['year']))[-1]
+    year = rating_lists['year'][current]
+    month = rating_lists['month'][current]
+    tournament_ids = snapshot[TOURNAMENTS]['id'][
+        snapshot[TOURNAMENTS]['rating_list_id'] == rating_lists['id'][
+            current]]
+    game_total = np.isin(snapshot[GAMES]['tournament_id'],
+                         tournament_ids).sum()
+    player_total = ((snapshot[RATINGS]['year'] == year) &
+                    (snapshot[RATINGS]['month'] == month)).sum()
     headers = ['*', 'Кількість']
-    data = [{'*': 'Ігри', 'Кількість': game_total},
+    data = [{'*': 'Ігри', 'Кількість': int(game_total)},
             {'*': 'Турніри', 'Кількість': len(tournament_ids)},
-            {'*': 'Гравці', 'Кількість': player_total}]
+            {'*': 'Гравці', 'Кількість': int(player_total)}]
     return dict(headers=headers, data=data)
 
 
-@topic_processor
+@topic_processor(GAMES, TOURNAMENTS, PLAYERS)
 def entire_totals(props=None):
-    game_total = models.Game.query.count()
-    tournament_total = models.Tournament.query.count()
-    player_total = models.Player.query.count()
+    snapshot = analytics.snapshot()
     headers = ['*', 'Кількість']
-    data = [{'*': 'Ігри', 'Кількість': game_total},
-            {'*': 'Турніри', 'Кількість': tournament_total},
-            {'*': 'Гравці', 'Кількість': player_total}]
+    data = [{'*': 'Ігри', 'Кількість': len(snapshot[GAMES]['id'])},
+            {'*': 'Турніри', 'Кількість': len(snapshot[TOURNAMENTS]['id'])},
+            {'*': 'Гравці', 'Кількість': len(snapshot[PLAYERS]['id'])}]
     return dict(headers=headers, data=data)
 
 
@@ -357,19 +368,80 @@ def create_default_topics():
     db.session.commit()
 
 
-def calculate():
+def _process(app, processor, properties):
+    """Runs processor in its own app context, so with its own session."""
+    with app.app_context():
+        start = time.perf_counter()
+        data = PROCESSORS[processor](properties)
+        return data, time.perf_counter() - start
+
+
+def _data_version(topic, versions):
+    """Version of topic inputs: its properties and data sources."""
+    version = {source: versions[source]
+               for source in DEPENDS[topic.processor]}
+    version['topic'] = str(topic.updated_at)
+    return json.dumps(version, sort_keys=True)
+
+
+def _last_issues():
+    """`topic_id -> TopicIssue` latest issues of topics."""
+    last_ids = db.session.query(func.max(TopicIssue.id)).group_by(
+        TopicIssue.topic_id)
+    return {issue.topic_id: issue for issue in TopicIssue.query.filter(
+        TopicIssue.id.in_(last_ids.subquery()))}
+
+
+def calculate(workers=None, full=False):
+    """
+    Runs processors of active topics in parallel threads, every one with
+    its own read session, and commits all new issues in one transaction.
+    Topics whose data sources didn't change since their last issue are
+    skipped unless `full`. A new issue replaces the issue of the same
+    period.
+    """
+    app = current_app._get_current_object()
+    workers = workers or app.config.get('STATISTICS_WORKERS', 4)
     current_app.logger.info('Calculating statistics')
-    topics = models.Topic.query.filter_by(active=True).all()
+    versions = analytics.data_versions()
+    last_issues = _last_issues()
+    topics = []
+    for t in models.Topic.query.filter_by(active=True):
+        version = _data_version(t, versions)
+        last_issue = last_issues.get(t.id)
+        if full or not last_issue or last_issue.data_version != version:
+            topics.append((t, version))
+    current_app.logger.info(f'Topics to calculate: {len(topics)}')
+    if not topics:
+        return
+    start = time.perf_counter()
+    analytics.refresh(versions)
     sys.stdout.write('Progress: 0 %')
     progress = 0
-    for t in topics:
-        data = PROCESSORS[t.processor](t.properties)
-        topic_issue = models.TopicIssue(t.id, data)
-        topic_issue.topic = t
-        set_date(topic_issue, datetime.date.today())
-        models.db.session.add(topic_issue)
-        progress += 1
-        sys.stdout.write(f'\rProgress: {progress/len(topics)*100:.3} %')
-
+    issues = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_process, app, t.processor,
+                                   t.properties): (t, version)
+                   for t, version in topics}
+        for future in as_completed(futures):
+            t, version = futures[future]
+            data, duration = future.result()
+            topic_issue = models.TopicIssue(t.id, data)
+            topic_issue.topic = t
+            topic_issue.duration = duration
+            topic_issue.data_version = version
+            set_date(topic_issue, datetime.date.today())
+            issues.append(topic_issue)
+            progress += 1
+            sys.stdout.write(f'\rProgress: {progress/len(topics)*100:.3} %')
+            current_app.logger.info(f'{t.name}: {duration:.2f} s')
+
+    for issue in issues:
+        TopicIssue.query.filter_by(
+            topic_id=issue.topic_id, period_date=issue.period_date).delete(
+            synchronize_session=False)
+    models.db.session.add_all(issues)
     models.db.session.commit()
     sys.stdout.write('\rProgress: 100 %\n')
+    current_app.logger.info(f'Calculated {len(issues)} topics in '
+                            f'{time.perf_counter() - start:.2f} s')
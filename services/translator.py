@@ -49,6 +49,17 @@ def get_translated(text, lang):
         return text
 
 
+def get_translated_all(texts, lang):
+    """Translations of texts with one query as `{text: translated}`."""
+    ids = {f'{t}_{lang}': t for t in set(texts) if isinstance(t, str)}
+    translated = {t: t for t in ids.values()}
+    for id, value in models.db.session.query(
+            models.Translation.id, models.Translation.translated).filter(
+            models.Translation.id.in_(list(ids))):
+        translated[ids[id]] = value
+    return translated
+
+
 def search_translations(text, lang=None):
     matches = models.Translation.query.filter(
         models.Translation.translated.like(text + '%'),
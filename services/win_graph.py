@@ -0,0 +1,567 @@
+"""
+Compact directed graph of wins for games chain search.
+Graph is stored in compressed sparse row form: successors of the node with
+index `i` are `indices[indptr[i]:indptr[i + 1]]`, predecessors are kept the
+same way in `rindptr`/`rindices`, `ids` is the sorted array of player ids,
+index of a player is found by binary search.
+Graph also keeps its condensation: strongly connected component of every
+node (component ids are in reverse topological order) and depth and height
+of every component in the condensation DAG. They answer most of queries
+without a path in O(1), other queries are answered by bidirectional breadth
+first search.
+Edges have weights (`WEIGHTS`, aligned with `indices`) for the search of
+the strongest chains: A* search where a hop costs `1 / weight` and Yen's
+algorithm for alternative chains, both limited by a time budget.
+On disk graph (as well as `PairCounts` it's built from) is a directory
+with `header.json` and an `.npy` file per array. Arrays are opened with
+mmap, so loading doesn't parse anything and processes opening the same
+graph share it in the page cache.
+"""
+import heapq
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+# edge weights: sum of contributions of wins over the opponent and the
+# best rating of the opponent at the time of a win
+WEIGHTS = ('contribution', 'rating')
+FORMAT = 'win-graph'
+FORMAT_VERSION = 3
+ARRAYS = ('ids', 'indptr', 'indices', 'rindptr', 'rindices', 'component',
+          'depth', 'height') + WEIGHTS
+PAIRS_FORMAT = 'win-pairs'
+PAIRS_FORMAT_VERSION = 3
+PAIRS_ARRAYS = ('src', 'dst', 'wins', 'net') + WEIGHTS
+
+
+class Timeout(Exception):
+    pass
+
+
+def save_arrays(path, format, version, arrays, **header):
+    """
+    Writes arrays and header to `path` directory. Files are written next to
+    it and then renamed, so readers never see partially written data.
+    """
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    header = dict(header, format=format, version=version, arrays={})
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+        header['arrays'][name] = str(array.dtype)
+    with open(os.path.join(tmp_path, 'header.json'), 'w') as f:
+        json.dump(header, f)
+    old_path = path + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def load_header(path):
+    with open(os.path.join(path, 'header.json')) as f:
+        return json.load(f)
+
+
+def load_arrays(path, format, version, names, mmap=True):
+    """Returns arrays (memory mapped by default) and header of `path`."""
+    header = load_header(path)
+    if header.get('format') != format or header.get('version') != version:
+        raise ValueError(f'Unsupported format in {path}: '
+                         f'{header.get("format")} {header.get("version")}')
+    arrays = [np.load(os.path.join(path, f'{name}.npy'),
+                      mmap_mode='r' if mmap else None) for name in names]
+    # plain arrays over the same memory, memmap indexing is much slower
+    return [a.view(np.ndarray) for a in arrays], header
+
+
+def _csr(src, dst, size):
+    """Returns indptr, indices and order of edges sorted by source."""
+    order = np.lexsort((dst, src))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=size), out=indptr[1:])
+    return indptr, dst[order].astype(np.int32), order
+
+
+def _components(indptr, indices):
+    """
+    Strongly connected components by iterative Tarjan's algorithm.
+    :return: component of every node, ids of components are in reverse
+    topological order (edges go from greater ids to lesser).
+    """
+    size = len(indptr) - 1
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    index = [-1] * size
+    low = [0] * size
+    on_stack = [False] * size
+    component = [-1] * size
+    stack = []
+    counter = 0
+    components = 0
+    for root in range(size):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, indptr[root])]
+        while work:
+            v, i = work[-1]
+            if i < indptr[v + 1]:
+                work[-1] = (v, i + 1)
+                w = indices[i]
+                if index[w] == -1:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, indptr[w]))
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+                continue
+            work.pop()
+            if work and low[v] < low[work[-1][0]]:
+                low[work[-1][0]] = low[v]
+            if low[v] == index[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component[w] = components
+                    if w == v:
+                        break
+                components += 1
+    return np.array(component, dtype=np.int32)
+
+
+def _levels(component, src, dst):
+    """
+    Depth (longest path from a source) and height (longest path to a sink)
+    of every component in the condensation DAG.
+    """
+    count = int(component.max()) + 1 if len(component) else 0
+    depth = [0] * count
+    height = [0] * count
+    src, dst = component[src], component[dst]
+    between = src != dst
+    edges = np.unique(np.stack([src[between], dst[between]], axis=1),
+                      axis=0).tolist()
+    # edges go to lesser component ids, so sorted by source they are in
+    # reverse topological order
+    for a, b in reversed(edges):
+        if depth[a] >= depth[b]:
+            depth[b] = depth[a] + 1
+    for a, b in edges:
+        if height[b] >= height[a]:
+            height[a] = height[b] + 1
+    return np.array(depth, dtype=np.int32), np.array(height, dtype=np.int32)
+
+
+class WinGraph:
+    def __init__(self, ids, indptr, indices, rindptr, rindices, component,
+                 depth, height, contribution, rating):
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.rindptr = rindptr
+        self.rindices = rindices
+        self.component = component
+        self.depth = depth
+        self.height = height
+        self.contribution = contribution
+        self.rating = rating
+
+    @classmethod
+    def from_edges(cls, src, dst, contribution=None, rating=None):
+        """Builds graph from arrays of edges player ids and weights."""
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        ids = np.unique(np.concatenate([src, dst]))
+        src = np.searchsorted(ids, src)
+        dst = np.searchsorted(ids, dst)
+        indptr, indices, order = _csr(src, dst, len(ids))
+        rindptr, rindices, _ = _csr(dst, src, len(ids))
+        component = _components(indptr, indices)
+        depth, height = _levels(component, src, dst)
+        weights = [np.ones(len(src), dtype=np.float32) if w is None else
+                   np.asarray(w, dtype=np.float32)[order]
+                   for w in (contribution, rating)]
+        return cls(ids, indptr, indices, rindptr, rindices, component,
+                   depth, height, *weights)
+
+    @classmethod
+    def from_adjacency(cls, adjacency):
+        """Builds graph from `{player_id: [won player ids]}` dict."""
+        src = [int(k) for k, nodes in adjacency.items() for _ in nodes]
+        dst = [v for nodes in adjacency.values() for v in nodes]
+        return cls.from_edges(src, dst)
+
+    def save(self, path):
+        save_arrays(path, FORMAT, FORMAT_VERSION,
+                    {name: getattr(self, name) for name in ARRAYS},
+                    nodes=len(self), edges=self.edges)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Opens graph saved by `save`, arrays are memory mapped."""
+        arrays, header = load_arrays(path, FORMAT, FORMAT_VERSION, ARRAYS,
+                                     mmap)
+        graph = cls(*arrays)
+        if len(graph) != header['nodes'] or graph.edges != header['edges']:
+            raise ValueError(f'Corrupted graph in {path}')
+        return graph
+
+    @staticmethod
+    def is_current(path):
+        """Checks if graph saved to `path` is of the current format."""
+        try:
+            header = load_header(path)
+        except (OSError, ValueError):
+            return False
+        return header.get('format') == FORMAT and \
+            header.get('version') == FORMAT_VERSION
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def index(self, id):
+        """Returns index of player id or None if it's not in the graph."""
+        i = np.searchsorted(self.ids, id)
+        if i < len(self.ids) and self.ids[i] == id:
+            return int(i)
+        return None
+
+    @staticmethod
+    def _expand(frontier, indptr, indices):
+        """Returns (sources, neighbours) arrays of all edges of frontier."""
+        starts = indptr[frontier]
+        counts = indptr[frontier + 1] - starts
+        total = counts.sum()
+        if not total:
+            return frontier[:0], frontier[:0]
+        # positions of all edges of frontier in `indices`
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + \
+            np.arange(total)
+        return np.repeat(frontier, counts), indices[offsets]
+
+    def successors(self, frontier):
+        return self._expand(frontier, self.indptr, self.indices)
+
+    def predecessors(self, frontier):
+        return self._expand(frontier, self.rindptr, self.rindices)
+
+    def may_reach(self, source, target):
+        """
+        O(1) check by condensation. False means there is no path from
+        source to target node, True means there may be one.
+        """
+        a, b = self.component[source], self.component[target]
+        if a == b:
+            return True
+        return a > b and self.depth[a] < self.depth[b] and \
+            self.height[a] > self.height[b]
+
+    def _step(self, frontier, neighbours, distance, link, keep):
+        """Visits not visited neighbours of frontier, returns new ones."""
+        sources, nodes = neighbours(frontier)
+        new = (distance[nodes] == -1) & keep(nodes)
+        sources, nodes = sources[new], nodes[new]
+        # one of duplicate nodes wins, frontier gets it once
+        link[nodes] = sources
+        nodes = nodes[link[nodes] == sources]
+        distance[nodes] = distance[sources[0]] + 1 if len(nodes) else 0
+        return nodes
+
+    def shortest_path(self, source_id, target_id):
+        """
+        Path with the least number of wins. Bidirectional breadth first
+        search, the smaller frontier is expanded with array operations,
+        only nodes of components between source and target are visited.
+        :return: list of player ids or None if there is no path.
+        """
+        source = self.index(source_id)
+        target = self.index(target_id)
+        if source is None or target is None:
+            return None
+        if source == target:
+            return [source_id]
+        if not self.may_reach(source, target):
+            return None
+        component = self.component
+        low, high = component[target], component[source]
+        size = len(self.ids)
+        parent = np.full(size, -1, dtype=np.int64)
+        child = np.full(size, -1, dtype=np.int64)
+        forward = np.full(size, -1, dtype=np.int32)
+        backward = np.full(size, -1, dtype=np.int32)
+        forward[source] = backward[target] = 0
+        forward_frontier = np.array([source], dtype=np.int64)
+        backward_frontier = np.array([target], dtype=np.int64)
+        while forward_frontier.size and backward_frontier.size:
+            if forward_frontier.size <= backward_frontier.size:
+                forward_frontier = self._step(
+                    forward_frontier, self.successors, forward, parent,
+                    lambda nodes: component[nodes] >= low)
+                met = forward_frontier[backward[forward_frontier] != -1]
+            else:
+                backward_frontier = self._step(
+                    backward_frontier, self.predecessors, backward, child,
+                    lambda nodes: component[nodes] <= high)
+                met = backward_frontier[forward[backward_frontier] != -1]
+            if met.size:
+                # the shortest of paths through met nodes
+                node = int(met[np.argmin(forward[met] + backward[met])])
+                break
+        else:
+            return None
+        path = [node]
+        while path[-1] != source:
+            path.append(int(parent[path[-1]]))
+        path.reverse()
+        while path[-1] != target:
+            path.append(int(child[path[-1]]))
+        return [int(self.ids[i]) for i in path]
+
+    def _distances(self, start, neighbours, keep):
+        """Hops from start through kept nodes, -1 for not reachable."""
+        distance = np.full(len(self.ids), -1, dtype=np.int32)
+        distance[start] = 0
+        frontier = np.array([start], dtype=np.int64)
+        hops = 0
+        while frontier.size:
+            hops += 1
+            _, nodes = neighbours(frontier)
+            nodes = np.unique(nodes[keep(nodes)])
+            frontier = nodes[distance[nodes] == -1]
+            distance[frontier] = hops
+        return distance
+
+    def _on_paths(self, source, target):
+        """
+        Nodes lying on some path from source to target and their hops to
+        target (-1 for other nodes).
+        """
+        component = self.component
+        low, high = component[target], component[source]
+        reachable = self._distances(source, self.successors,
+                                    lambda nodes: component[nodes] >= low)
+        hops = self._distances(target, self.predecessors,
+                               lambda nodes: component[nodes] <= high)
+        hops[reachable == -1] = -1
+        return hops
+
+    def _edge(self, source, target):
+        """Position of edge in `indices`."""
+        start, end = self.indptr[source], self.indptr[source + 1]
+        return int(start + np.searchsorted(self.indices[start:end], target))
+
+    def _search(self, source, target, costs, estimate, allowed, banned,
+                deadline, limit=float('inf')):
+        """
+        A* search of the cheapest path over allowed nodes, `estimate` is a
+        consistent lower bound of the cost to target, hops from source to
+        `banned` nodes are skipped.
+        :return: (cost, path of nodes) or None if there is no path cheaper
+        than `limit`.
+        :raise Timeout: if deadline has passed.
+        """
+        distance = {source: 0.0}
+        parent = {}
+        done = set()
+        heap = [(estimate[source], 0.0, source)]
+        while heap:
+            bound, cost, node = heapq.heappop(heap)
+            if bound > limit:
+                return None
+            if node == target:
+                break
+            if node in done:
+                continue
+            done.add(node)
+            if time.perf_counter() > deadline:
+                raise Timeout()
+            start, end = self.indptr[node], self.indptr[node + 1]
+            nodes = self.indices[start:end]
+            keep = allowed[nodes]
+            if node == source and banned:
+                keep &= ~np.isin(nodes, banned)
+            nodes = nodes[keep]
+            next_costs = cost + costs[start:end][keep]
+            for next_node, next_cost, next_bound in zip(
+                    nodes.tolist(), next_costs.tolist(),
+                    (next_costs + estimate[nodes]).tolist()):
+                if next_cost < distance.get(next_node, float('inf')):
+                    distance[next_node] = next_cost
+                    parent[next_node] = node
+                    heapq.heappush(heap, (next_bound, next_cost, next_node))
+        else:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(parent[path[-1]])
+        path.reverse()
+        return distance[target], path
+
+    def strongest_paths(self, source_id, target_id, weight='rating', k=1,
+                        budget=0.2):
+        """
+        Up to k chains with the strongest wins: a hop costs `1 / weight`,
+        so the best chains are short and made of heavy wins. Chains are
+        searched by A* with hops to target as estimate, alternatives are
+        found by Yen's algorithm, only nodes lying on source-target paths
+        are visited. When `budget` seconds are over, chains found by then are
+        returned, or the shortest chain if none is found.
+        :return: list of paths of player ids, the strongest first.
+        """
+        deadline = time.perf_counter() + budget
+        source = self.index(source_id)
+        target = self.index(target_id)
+        if source is None or target is None:
+            return []
+        if source == target:
+            return [[source_id]]
+        if not self.may_reach(source, target):
+            return []
+        costs = 1.0 / np.maximum(getattr(self, weight), 1)
+        hops = self._on_paths(source, target)
+        allowed = hops != -1
+        # every remaining hop costs at least the cheapest one
+        estimate = np.maximum(hops, 0) * (costs.min() if len(costs) else 0)
+        paths = []
+        try:
+            first = self._search(source, target, costs, estimate, allowed,
+                                 (), deadline)
+            if first:
+                paths.append(first)
+            candidates = []
+            seen = {tuple(first[1])} if first else set()
+            while paths and len(paths) < k:
+                last = paths[-1][1]
+                for i in range(len(last) - 1):
+                    root = last[:i + 1]
+                    banned = [p[i + 1] for _, p in paths if p[:i + 1] == root]
+                    spur_allowed = allowed.copy()
+                    spur_allowed[root[:-1]] = False
+                    root_cost = sum(costs[self._edge(a, b)]
+                                    for a, b in zip(root, root[1:]))
+                    # chains costlier than enough candidates are not needed
+                    need = k - len(paths)
+                    limit = heapq.nsmallest(need, candidates)[-1][0] \
+                        if len(candidates) >= need else float('inf')
+                    found = self._search(root[-1], target, costs, estimate,
+                                         spur_allowed, banned, deadline,
+                                         limit - root_cost)
+                    if not found:
+                        continue
+                    path = root[:-1] + found[1]
+                    if tuple(path) in seen:
+                        continue
+                    seen.add(tuple(path))
+                    heapq.heappush(candidates, (root_cost + found[0], path))
+                if not candidates:
+                    break
+                paths.append(heapq.heappop(candidates))
+        except Timeout:
+            if not paths:
+                path = self.shortest_path(source_id, target_id)
+                return [path] if path else []
+        return [[int(self.ids[i]) for i in path] for _, path in paths]
+
+
+class PairCounts:
+    """
+    Results of games of every player against every opponent, graphs of
+    games chain are built from them. `net` is wins minus losses, weights
+    are described in `WEIGHTS`. `watermark` is the last game id counted,
+    `counted_at` is the timestamp games were counted at.
+    """
+
+    def __init__(self, src, dst, wins, net, contribution, rating,
+                 watermark=0, counted_at=None):
+        self.src = np.asarray(src, dtype=np.int64)
+        self.dst = np.asarray(dst, dtype=np.int64)
+        self.wins = np.asarray(wins, dtype=np.int32)
+        self.net = np.asarray(net, dtype=np.int32)
+        self.contribution = np.asarray(contribution, dtype=np.int32)
+        self.rating = np.asarray(rating, dtype=np.float32)
+        self.watermark = watermark
+        self.counted_at = counted_at
+
+    @classmethod
+    def empty(cls, watermark=0, counted_at=None):
+        return cls([], [], [], [], [], [], watermark, counted_at)
+
+    def __len__(self):
+        return len(self.src)
+
+    def merge(self, other):
+        """
+        Returns counts of both, results of the same pair are summed, the
+        best rating is taken.
+        """
+        arrays = {name: np.concatenate([getattr(self, name),
+                                        getattr(other, name)])
+                  for name in PAIRS_ARRAYS}
+        watermark = max(self.watermark, other.watermark)
+        if not len(arrays['src']):
+            return PairCounts.empty(watermark, self.counted_at)
+        order = np.lexsort((arrays['dst'], arrays['src']))
+        arrays = {name: array[order] for name, array in arrays.items()}
+        src, dst = arrays['src'], arrays['dst']
+        first = np.ones(len(src), dtype=bool)
+        first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+        first = np.flatnonzero(first)
+        return PairCounts(src[first], dst[first],
+                          np.add.reduceat(arrays['wins'], first),
+                          np.add.reduceat(arrays['net'], first),
+                          np.add.reduceat(arrays['contribution'], first),
+                          np.maximum.reduceat(arrays['rating'], first),
+                          watermark, self.counted_at)
+
+    def replace(self, players, other):
+        """Returns counts with pairs of `players` taken from `other`."""
+        keep = ~np.isin(self.src, np.asarray(players, dtype=np.int64))
+        kept = PairCounts(*[getattr(self, name)[keep]
+                            for name in PAIRS_ARRAYS],
+                          watermark=self.watermark,
+                          counted_at=self.counted_at)
+        return kept.merge(other)
+
+    def _graph(self, edges):
+        return WinGraph.from_edges(self.src[edges], self.dst[edges],
+                                   self.contribution[edges],
+                                   self.rating[edges])
+
+    def graph(self):
+        """Edge to every opponent won at least once."""
+        return self._graph(self.wins > 0)
+
+    def graph_all(self):
+        """Edge to every opponent with more wins than losses against."""
+        return self._graph(self.net > 0)
+
+    def save(self, path):
+        save_arrays(path, PAIRS_FORMAT, PAIRS_FORMAT_VERSION,
+                    {name: getattr(self, name) for name in PAIRS_ARRAYS},
+                    watermark=self.watermark, counted_at=self.counted_at)
+
+    @classmethod
+    def load(cls, path):
+        arrays, header = load_arrays(path, PAIRS_FORMAT, PAIRS_FORMAT_VERSION,
+                                     PAIRS_ARRAYS, False)
+        return cls(*arrays, watermark=header['watermark'],
+                   counted_at=header['counted_at'])
@@ -0,0 +1,95 @@
+"""
+Reading of ITTF world ranking XLS files.
+Sheets are read row by row with xlrd on demand mode, columns are found by
+the header row, so files of different years with different layouts work.
+"""
+import xlrd
+
+from models import db, WorldPlayer
+
+CHUNK_SIZE = 500  # max number of bound parameters in one IN clause
+
+# prefixes of header cells of needed columns
+COLUMNS = {
+    'position': ('rank', 'pos'),
+    'name': ('name',),
+    'country': ('assoc', 'country', 'nat'),
+    'rating': ('points', 'rating'),
+}
+
+
+def _header(values):
+    columns = {}
+    for i, value in enumerate(values):
+        value = str(value).strip().lower()
+        for column, prefixes in COLUMNS.items():
+            if column not in columns and value.startswith(prefixes):
+                columns[column] = i
+    return columns if len(columns) == len(COLUMNS) else None
+
+
+def read_rows(contents):
+    """
+    Yields dicts with position, name, country and rating for every player
+    row of the first sheet of XLS file contents.
+    """
+    book = xlrd.open_workbook(file_contents=contents, on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        columns = None
+        for i in range(sheet.nrows):
+            values = sheet.row_values(i)
+            if columns is None:
+                columns = _header(values)
+                continue
+            try:
+                row = {
+                    'position': int(values[columns['position']]),
+                    'name': str(values[columns['name']]).strip(),
+                    'country': str(values[columns['country']]).strip(),
+                    'rating': int(values[columns['rating']]),
+                }
+            except (ValueError, IndexError):
+                continue
+            if row['name'] and row['country']:
+                yield row
+    finally:
+        book.release_resources()
+
+
+class WorldPlayerMap:
+    """`(name, country_code) -> WorldPlayer.id` of one category."""
+
+    def __init__(self, category):
+        self.category = category
+        self.ids = {(name, country): id for id, name, country in
+                    db.session.query(WorldPlayer.id, WorldPlayer.name,
+                                     WorldPlayer.country_code).filter_by(
+                        category=category)}
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def get(self, key):
+        return self.ids.get(key)
+
+    def add(self, players):
+        """
+        Bulk inserts not mapped players.
+        :param players: list of dicts with WorldPlayer columns, `name` and
+        `country_code` are required.
+        """
+        players = {(p['name'], p['country_code']): p for p in players
+                   if (p['name'], p['country_code']) not in self.ids}
+        if not players:
+            return
+        db.session.bulk_insert_mappings(WorldPlayer, [
+            dict(p, category=self.category) for p in players.values()])
+        names = list({name for name, _ in players})
+        for i in range(0, len(names), CHUNK_SIZE):
+            for id, name, country in db.session.query(
+                    WorldPlayer.id, WorldPlayer.name,
+                    WorldPlayer.country_code).filter(
+                    WorldPlayer.category == self.category,
+                    WorldPlayer.name.in_(names[i:i + CHUNK_SIZE])):
+                self.ids.setdefault((name, country), id)
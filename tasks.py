@@ -1,12 +1,12 @@
 import datetime
-from services import rating_update
+from services import rating_update, job_runs
 import models as m
 from app import app
 
 
 def task(f):
     def wrapper():
-        with app.app_context():
+        with app.app_context(), job_runs.record(f.__name__):
             f()
 
     return wrapper
@@ -0,0 +1,31 @@
+"""
+Unit tests of cache warming: warmed pages must be found by visitors.
+    pytest cache_warming.py
+"""
+from flask import request
+from werkzeug.test import create_environ
+
+from app import app
+from services.cache_warming import USER_AGENTS
+from views.common import page_key
+
+URLS = ['/uk/rating/', '/ru/rating/WOMEN/', '/uk/win-chain/?k=2&mode=shortest']
+
+
+def _key(context):
+    with context:
+        app.preprocess_request()
+        return request.MOBILE, page_key()()
+
+
+def test_page_keys():
+    for device, user_agent in USER_AGENTS.items():
+        for url in URLS:
+            headers = {'User-Agent': user_agent}
+            # as rendered by `cache_warming._render`
+            warmed = _key(app.test_request_context(url, headers=headers))
+            # as requested by a visitor through the site host
+            visited = _key(app.request_context(create_environ(
+                url, 'https://ttennis.life/', headers=headers)))
+            assert warmed == visited
+            assert warmed[0] == (device == 'mobile')
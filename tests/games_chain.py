@@ -0,0 +1,68 @@
+"""
+Unit tests of games of chain of wins.
+    pytest games_chain.py
+"""
+import datetime
+
+import pytest
+from flask import Flask
+
+import models as m
+from services.benchmark import count_statements
+from services.games_chain import chain_games
+
+HOPS = 6
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://',
+                      SQLALCHEMY_TRACK_MODIFICATIONS=False,
+                      WIN_CHAIN_HOP_GAMES=2)
+    m.db.init_app(app)
+    with app.app_context():
+        m.db.create_all()
+        yield app
+        m.db.session.remove()
+
+
+@pytest.fixture
+def chain(app):
+    players = [m.Player(id=i, name=str(i), city='Київ')
+               for i in range(1, HOPS + 2)]
+    m.db.session.add_all(players)
+    m.db.session.add(m.Tournament(id=1, name='Кубок'))
+    for player, opponent in zip(players, players[1:]):
+        for day, result in [(1, True), (2, True), (3, False), (4, True)]:
+            m.db.session.add(m.Game(
+                player_id=player.id, opponent_id=opponent.id, result=result,
+                tournament_id=1, date=datetime.date(2018, 1, day)))
+        # games of other direction are not hops
+        m.db.session.add(m.Game(player_id=opponent.id,
+                                opponent_id=player.id, result=True,
+                                date=datetime.date(2018, 1, 5)))
+    m.db.session.commit()
+    return players
+
+
+def test_chain_games(chain):
+    hops = chain_games(chain)
+    assert len(hops) == HOPS
+    for player, opponent, games in zip(chain, chain[1:], hops):
+        # latest wins first, at most WIN_CHAIN_HOP_GAMES
+        assert [(g.player_id, g.opponent_id, g.date.day) for g in games] == \
+            [(player.id, opponent.id, 4), (player.id, opponent.id, 2)]
+    assert [g.date.day for g in chain_games(chain, all=True)[0]] == [4, 3]
+    assert chain_games(chain[:1]) == []
+
+
+def test_chain_games_statements(chain):
+    m.db.session.expire_all()
+    # players of the chain are loaded by the view
+    m.Player.query.all()
+    with count_statements() as counter:
+        hops = chain_games(chain)
+        assert {g.tournament.name for games in hops for g in games} == \
+            {'Кубок'}
+    assert counter['statements'] == 1
@@ -0,0 +1,60 @@
+"""
+Unit tests of html tables extraction, both backends must give the same rows.
+    pytest html_tables.py
+"""
+import pytest
+
+from services import html_tables
+from services.html_tables import BACKENDS, Cell
+
+PAGE = '''<html><head><meta charset="utf-8"></head><body>
+<table class="menu"><tr><td><a href="/rating/">Рейтинг</a></td></tr></table>
+<table id="sortTable" class="ui table">
+  <tr><th>№</th><th>Гравець</th></tr>
+  <tr><td>1</td><td><a href="/rating/p/1/101/">Іваненко Іван</a></td>
+      <td>512,3</td><td></td><td><span>Київ</span>-Львів</td></tr>
+  <tr><td></td><td><a href="/rating/p/1/102/"><b>Петренко</b> Петро</a></td>
+      <td>498,0</td><td>10</td><td>Одеса</td></tr>
+  <tr><td>3</td><td>без посилання</td>
+      <td><table><tr><td>вкладена</td></tr></table></td></tr>
+</table>
+<table id="tourn-table">
+  <tr><td><a href="/rating/t/1/7/">Кубок</a></td><td>Київ</td><td>Суддя</td>
+  </tr>
+</table>
+</body></html>'''
+
+
+def _rows(backend, html, **table):
+    return list(BACKENDS[backend](html).rows(**table))
+
+
+@pytest.mark.parametrize('table', [{}, {'id': 'sortTable'},
+                                   {'cls': 'table'}, {'id': 'tourn-table'},
+                                   {'id': 'missing'}])
+def test_backends_parity(table):
+    expected = _rows('html.parser', PAGE, **table)
+    assert _rows('lxml', PAGE, **table) == expected
+    assert _rows('lxml', PAGE.encode(), **table) == expected
+
+
+def test_rows():
+    rows = _rows('lxml', PAGE, id='sortTable')
+    assert rows[0] == []
+    assert rows[1][:3] == [Cell('1', None),
+                           Cell('Іваненко Іван', '/rating/p/1/101/'),
+                           Cell('512,3', None)]
+    assert rows[1][3:] == [Cell(None, None), Cell('Київ', None)]
+    assert rows[2][1] == Cell('Петренко', '/rating/p/1/102/')
+    assert rows[2][0].text is None
+    assert _rows('lxml', PAGE, id='tourn-table') == [
+        [Cell('Кубок', '/rating/t/1/7/'), Cell('Київ', None),
+         Cell('Суддя', None)]]
+    assert _rows('lxml', PAGE, id='missing') == []
+
+
+def test_parse_backend():
+    assert isinstance(html_tables.parse(PAGE, 'lxml'),
+                      html_tables.LxmlDocument)
+    assert isinstance(html_tables.parse(PAGE, 'html.parser'),
+                      html_tables.SoupDocument)
@@ -0,0 +1,80 @@
+"""
+Unit tests of HTTP response cache.
+    pytest http_cache.py
+"""
+import time
+
+import requests
+
+from services.http_cache import ResponseCache
+
+URL = 'http://reiting.com.ua/rating/nat/1/0/'
+
+
+def _response(status_code=200, body=b'', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = URL + '?limit=0'
+    response.encoding = 'utf-8'
+    response.headers.update(headers or {})
+    response._content = body
+    return response
+
+
+def test_conditional_request(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    assert cache.headers(URL) == {}
+    response = cache.update(URL, _response(body=b'page', headers={
+        'ETag': '"1"', 'Last-Modified': 'Mon, 01 Oct 2018 00:00:00 GMT'}))
+    assert not response.unchanged
+    assert cache.headers(URL) == {
+        'If-None-Match': '"1"',
+        'If-Modified-Since': 'Mon, 01 Oct 2018 00:00:00 GMT'}
+    # not modified answer is replaced with the cached page
+    response = cache.update(URL, _response(304))
+    assert (response.status_code, response.text) == (200, 'page')
+    assert response.url == URL + '?limit=0'
+    assert response.unchanged
+    assert cache.stats['not_modified'] == 1
+    assert cache.stats['bytes_saved'] == 4
+
+
+def test_same_body(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    cache.update(URL, _response(body=b'page'))
+    assert cache.update(URL, _response(body=b'page')).unchanged
+    assert not cache.update(URL, _response(body=b'new page')).unchanged
+    response = cache.update(URL, _response(304))
+    assert response.text == 'new page'
+    assert cache.stats['same_body'] == 1
+
+
+def test_errors_are_not_cached(tmpdir):
+    cache = ResponseCache(str(tmpdir))
+    assert cache.update(URL, _response(500)).status_code == 500
+    # 304 without cached page is returned as is
+    assert cache.update(URL, _response(304)).status_code == 304
+    assert cache.headers(URL) == {}
+
+
+def test_ttl(tmpdir):
+    cache = ResponseCache(str(tmpdir), ttl=-1)
+    cache.update(URL, _response(body=b'page', headers={'ETag': '"1"'}))
+    assert cache.headers(URL) == {}
+    assert cache.update(URL, _response(304)).status_code == 304
+
+
+def test_forget_and_evict(tmpdir):
+    cache = ResponseCache(str(tmpdir), max_entries=2)
+    for i in range(4):
+        cache.update(f'{URL}{i}', _response(body=b'page',
+                                            headers={'ETag': str(i)}))
+        time.sleep(0.01)
+    cache.forget(f'{URL}3')
+    assert cache.headers(f'{URL}3') == {}
+    cache.evict()
+    assert cache.stats['evicted'] == 1
+    # the latest checked entries stay
+    assert [bool(cache.headers(f'{URL}{i}')) for i in range(3)] == \
+        [False, True, True]
+    assert len(tmpdir.listdir()) == 4
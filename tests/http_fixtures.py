@@ -0,0 +1,48 @@
+"""
+Unit tests of HTTP traffic record/replay.
+    pytest http_fixtures.py
+"""
+import requests
+from requests.adapters import HTTPAdapter
+
+from services.http_fixtures import RecordingAdapter, ReplayAdapter
+
+URL = 'http://reiting.com.ua/rating/nat/1/0/'
+
+
+def _send(adapter, request, **kwargs):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = request.url
+    response.encoding = 'utf-8'
+    response.headers['Content-Type'] = 'text/html'
+    response._content = request.url.encode()
+    return response
+
+
+def _session(adapter):
+    session = requests.Session()
+    session.mount('http://', adapter)
+    return session
+
+
+def test_record_replay(tmpdir, monkeypatch):
+    monkeypatch.setattr(HTTPAdapter, 'send', _send)
+    path = str(tmpdir.join('fixtures.zip'))
+    recorder = RecordingAdapter(path)
+    with _session(recorder) as session:
+        for i in range(3):
+            session.get(f'{URL}{i}')
+        # pages fetched again are saved once
+        session.get(f'{URL}0')
+        assert len(recorder.keys) == 3
+    # the session closes the recorder
+    assert recorder.archive.fp is None
+
+    replay = ReplayAdapter(path)
+    with _session(replay) as session:
+        assert len(replay.keys) == 6
+        response = session.get(f'{URL}1')
+        assert (response.status_code, response.text) == (200, f'{URL}1')
+        assert response.headers['Content-Type'] == 'text/html'
+        assert session.get(f'{URL}3').status_code == 404
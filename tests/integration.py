@@ -4,6 +4,9 @@ Pytest integration tests.
 To run tests you may need to override some configs.
 To do that you need to specify your testing configs:
     APP_CONFIG=testing.cfg pytest integration.py
+To run parser tests offline, record http fixtures once with
+`flask parse_ua --record fixtures.zip` and set `PARSER_FIXTURES`
+in testing configs.
 """
 import datetime
 from services import parser, translator, rating_update, statistics
@@ -0,0 +1,54 @@
+"""
+Unit tests of rating table diff.
+    pytest rating_diff.py
+"""
+from collections import namedtuple
+
+from services.rating_diff import Diff, load_rows
+
+
+def _player(external_id, rating, **fields):
+    return dict(fields, external_id=external_id, rating=rating)
+
+
+def test_diff():
+    current = {
+        1: _player(1, 500.0, id=10),
+        2: _player(2, 400.0, id=20, city='Київ'),
+        3: _player(3, 300.0, id=30),
+    }
+    incoming = [_player(1, 500.0), _player(2, 400.0, city='Львів'),
+                _player(4, 100.0)]
+    diff = Diff(current, incoming, 'external_id')
+    assert diff.new == [_player(4, 100.0)]
+    assert diff.changed == [_player(2, 400.0, id=20, city='Львів')]
+    assert diff.changed_fields == {2: {'city'}}
+    assert diff.unchanged == 1
+    assert diff.dropped == [current[3]]
+    assert diff.counts() == {'new': 1, 'changed': 1, 'unchanged': 1,
+                             'dropped': 1}
+    assert str(diff) == 'new: 1, changed: 1, unchanged: 1, dropped: 1'
+
+
+def test_diff_fields_not_parsed():
+    # stored fields missing in incoming rows are not changes
+    current = {1: _player(1, 500.0, id=10, max=600.0)}
+    diff = Diff(current, [_player(1, 510.0)], 'external_id')
+    assert diff.changed == [_player(1, 510.0, id=10)]
+    assert diff.changed_fields == {1: {'rating'}}
+    assert not diff.new and not diff.dropped
+
+
+def test_diff_empty():
+    diff = Diff({}, [], 'external_id')
+    assert diff.counts() == {'new': 0, 'changed': 0, 'unchanged': 0,
+                             'dropped': 0}
+    rows = [_player(i, 0.0) for i in range(3)]
+    assert Diff({}, rows, 'external_id').new == rows
+
+
+def test_load_rows():
+    Row = namedtuple('Row', 'id external_id rating')
+    rows = load_rows([Row(10, 1, 500.0), Row(20, 2, 400.0)], 'external_id')
+    assert rows == {1: {'id': 10, 'external_id': 1, 'rating': 500.0},
+                    2: {'id': 20, 'external_id': 2, 'rating': 400.0}}
@@ -0,0 +1,114 @@
+"""
+Unit tests of rating update subtasks graph.
+    pytest rating_update.py
+"""
+import threading
+import time
+
+import pytest
+
+from app import app
+from models import db, DagRun
+from services.rating_update import run_dag, subtask
+
+with app.app_context():
+    db.create_all()
+
+
+def _subtasks(log):
+    @subtask('first')
+    def first(value):
+        time.sleep(0.2)
+        log.append(('first', value))
+
+    @subtask('second')
+    def second():
+        time.sleep(0.2)
+        log.append('second')
+
+    @subtask('both', depends=(first, second))
+    def both():
+        log.append('both')
+
+    @subtask('fails', depends=(first,))
+    def fails():
+        raise ValueError('boom')
+
+    @subtask('after fails', depends=(fails,))
+    def after_fails():
+        log.append('after fails')
+
+    @subtask('after skipped', depends=(after_fails,))
+    def after_skipped():
+        log.append('after skipped')
+
+    @subtask('finally', depends=(both, fails), always=True)
+    def finally_():
+        log.append('finally')
+
+    return first, second, both, fails, after_fails, after_skipped, finally_
+
+
+def _statuses(run):
+    return {e['name']: e['status'] for e in run.timeline}
+
+
+def test_run_dag_order():
+    log = []
+    first, second, both, *_ = _subtasks(log)
+    with app.app_context():
+        start = time.perf_counter()
+        run = run_dag('test', [(both,), (first, 1), (second,)], workers=2)
+        # independent subtasks run at the same time
+        assert time.perf_counter() - start < 0.35
+    assert sorted(log[:2], key=str) == [('first', 1), 'second']
+    assert log[2] == 'both'
+    assert run.status == DagRun.DONE
+    # timeline is in order of steps
+    assert [e['name'] for e in run.timeline] == ['both', 'first', 'second']
+    assert run.timeline[0]['start'] >= max(e['end'] for e in run.timeline[1:])
+
+
+def test_run_dag_failure():
+    log = []
+    steps = [(step,) for step in _subtasks(log)]
+    steps[0] = steps[0] + (1,)
+    with app.app_context():
+        run = run_dag('test', steps)
+        assert DagRun.query.get(run.id).status == DagRun.FAILED
+    assert _statuses(run) == {
+        'first': DagRun.DONE, 'second': DagRun.DONE, 'both': DagRun.DONE,
+        'fails': DagRun.FAILED, 'after fails': DagRun.SKIPPED,
+        'after skipped': DagRun.SKIPPED, 'finally': DagRun.DONE}
+    assert run.timeline[3]['error'] == 'boom'
+    assert 'after fails' not in log and 'after skipped' not in log
+    assert log[-1] == 'finally'
+
+
+def test_run_dag_raises():
+    log = []
+    first, _, _, fails, *_ = _subtasks(log)
+    with app.app_context():
+        with pytest.raises(RuntimeError):
+            run_dag('test', [(first, 1), (fails,)], raises=True)
+        # dependencies out of steps are ignored
+        run = run_dag('test', [(fails,)])
+    assert _statuses(run) == {'fails': DagRun.FAILED}
+
+
+def test_subtask_writes_lock():
+    from services.parser import WRITE_LOCK
+    held = []
+
+    @subtask('writer', writes=True)
+    def writer():
+        # the lock is reentrant, other threads can't take it
+        thread = threading.Thread(
+            target=lambda: held.append(not WRITE_LOCK.acquire(False)))
+        thread.start()
+        thread.join()
+
+    with app.app_context():
+        run = run_dag('test', [(writer,)])
+    assert run.status == DagRun.DONE
+    assert held == [True]
@@ -0,0 +1,41 @@
+"""
+Unit tests of statistics processors on a small generated dataset.
+    pytest statistics_processors.py
+"""
+import pytest
+from flask import Flask
+
+import models as m
+from services import analytics, benchmark, statistics
+
+# processors computed from analytics snapshot only
+SNAPSHOT_PROCESSORS = {'rating_dynamics', 'tournament_dynamics_by_year',
+                       'tournament_dynamics_by_city', 'most_active_judges',
+                       'last_ranking_total', 'entire_totals'}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://',
+                      SQLALCHEMY_TRACK_MODIFICATIONS=False)
+    m.db.init_app(app)
+    with app.app_context():
+        m.db.create_all()
+        benchmark.statistics_data(players=200, tournaments=30, games=2000,
+                                  years=2)
+        yield app
+        m.db.session.remove()
+
+
+def test_processors_statements(app):
+    results = benchmark.statistics_processors()
+    # data versions and one scan of every source
+    assert results.pop('analytics snapshot')['statements'] == \
+        len(analytics.SOURCES) + 1
+    assert {r['processor'] for r in results.values()} == \
+        set(statistics.PROCESSORS)
+    for name, result in results.items():
+        expected = 0 if result['processor'] in SNAPSHOT_PROCESSORS else \
+            benchmark.STATISTICS_STATEMENTS
+        assert result['statements'] == expected, name
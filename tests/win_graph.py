@@ -0,0 +1,241 @@
+"""
+Unit tests of games chain graph, results are compared with plain python
+searches on small random graphs.
+    pytest win_graph.py
+"""
+import random
+from collections import deque
+
+import numpy as np
+import pytest
+
+from services.win_graph import PairCounts, WinGraph
+
+
+def _random_edges(seed, nodes=12, edges=30):
+    """Unique edges without loops between sparse player ids and weights."""
+    rnd = random.Random(seed)
+    pairs = set()
+    while len(pairs) < edges:
+        a, b = rnd.sample(range(nodes), 2)
+        pairs.add((a * 7 + 3, b * 7 + 3))
+    src, dst = zip(*sorted(pairs))
+    contribution = [rnd.randint(0, 20) for _ in src]
+    rating = [rnd.uniform(0, 100) for _ in src]
+    return list(src), list(dst), contribution, rating
+
+
+def _adjacency(src, dst):
+    adjacency = {}
+    for a, b in zip(src, dst):
+        adjacency.setdefault(a, set()).add(b)
+    return adjacency
+
+
+def _distances(adjacency, source):
+    """Hops from source by breadth first search."""
+    distance = {source: 0}
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        for next_node in adjacency.get(node, ()):
+            if next_node not in distance:
+                distance[next_node] = distance[node] + 1
+                queue.append(next_node)
+    return distance
+
+
+def test_csr():
+    for seed in range(20):
+        src, dst, contribution, rating = _random_edges(seed)
+        graph = WinGraph.from_edges(src, dst, contribution, rating)
+        weights = {(a, b): (c, r) for a, b, c, r in
+                   zip(src, dst, contribution, rating)}
+        assert list(graph.ids) == sorted(set(src) | set(dst))
+        assert graph.edges == len(src)
+        for i, id in enumerate(graph.ids):
+            assert graph.index(id) == i
+            start, end = graph.indptr[i], graph.indptr[i + 1]
+            successors = [int(graph.ids[j]) for j in graph.indices[start:end]]
+            assert successors == sorted(b for a, b in weights if a == id)
+            for j in range(start, end):
+                c, r = weights[id, int(graph.ids[graph.indices[j]])]
+                assert graph.contribution[j] == c
+                assert np.isclose(graph.rating[j], r)
+            start, end = graph.rindptr[i], graph.rindptr[i + 1]
+            assert sorted(int(graph.ids[j]) for j in
+                          graph.rindices[start:end]) == \
+                sorted(a for a, b in weights if b == id)
+        assert graph.index(max(graph.ids) + 1) is None
+
+
+def test_from_adjacency():
+    graph = WinGraph.from_adjacency({'1': [2, 3], '3': [1]})
+    assert list(graph.ids) == [1, 2, 3]
+    assert graph.edges == 3
+    assert list(graph.contribution) == [1, 1, 1]
+    assert graph.shortest_path(3, 2) == [3, 1, 2]
+
+
+def _random_games(seed, count=300, players=10):
+    rnd = random.Random(seed)
+    return [(*rnd.sample(range(1, players + 1), 2), rnd.random() < 0.5,
+             rnd.randint(0, 10), float(rnd.randint(0, 1000)))
+            for _ in range(count)]
+
+
+def _pair_counts(games, watermark=0):
+    """Counts pairs the same way as `games_chain.count_pairs` query."""
+    pairs = {}
+    for player, opponent, won, contribution, rating in games:
+        wins, net, total, best = pairs.get((player, opponent), (0, 0, 0, 0))
+        pairs[player, opponent] = (
+            wins + won, net + (1 if won else -1),
+            total + contribution * won, max(best, rating * won))
+    keys = sorted(pairs)
+    if not keys:
+        return PairCounts.empty(watermark)
+    return PairCounts(*zip(*[key + pairs[key] for key in keys]),
+                      watermark=watermark)
+
+
+def _pairs(counts):
+    return sorted(zip(counts.src.tolist(), counts.dst.tolist(),
+                      counts.wins.tolist(), counts.net.tolist(),
+                      counts.contribution.tolist(), counts.rating.tolist()))
+
+
+def test_pair_counts_merge():
+    for seed in range(10):
+        games = _random_games(seed)
+        counts = PairCounts.empty()
+        for start in range(0, len(games), 70):
+            chunk = games[start:start + 70]
+            counts = counts.merge(_pair_counts(chunk, start + len(chunk)))
+        assert _pairs(counts) == _pairs(_pair_counts(games))
+        assert counts.watermark == len(games)
+
+
+def test_pair_counts_replace():
+    games = _random_games(1)
+    changed = [2, 5]
+    # results of games of changed players are different now
+    fixed = [(p, o, not won, c, r) if p in changed else (p, o, won, c, r)
+             for p, o, won, c, r in games]
+    counts = _pair_counts(games, 300).replace(
+        changed, _pair_counts([g for g in fixed if g[0] in changed]))
+    assert _pairs(counts) == _pairs(_pair_counts(fixed))
+    assert counts.watermark == 300
+
+
+def test_pair_counts_save(tmpdir):
+    path = str(tmpdir.join('pairs'))
+    counts = _pair_counts(_random_games(2), 300)
+    counts.counted_at = 1500000000.5
+    counts.save(path)
+    loaded = PairCounts.load(path)
+    assert _pairs(loaded) == _pairs(counts)
+    assert (loaded.watermark, loaded.counted_at) == (300, 1500000000.5)
+    assert loaded.graph().edges == int((counts.wins > 0).sum())
+    assert loaded.graph_all().edges == int((counts.net > 0).sum())
+
+
+def test_components():
+    for seed in range(20):
+        src, dst, *_ = _random_edges(seed, edges=seed + 5)
+        graph = WinGraph.from_edges(src, dst)
+        adjacency = _adjacency(src, dst)
+        reach = {id: _distances(adjacency, id) for id in graph.ids.tolist()}
+        component = dict(zip(graph.ids.tolist(), graph.component.tolist()))
+        for a in reach:
+            for b in reach:
+                assert (component[a] == component[b]) == \
+                    (b in reach[a] and a in reach[b])
+                if b in reach[a]:
+                    # edges go to lesser components, no false negatives
+                    assert component[a] >= component[b]
+                    assert graph.may_reach(graph.index(a), graph.index(b))
+
+
+def test_shortest_path():
+    for seed in range(30):
+        src, dst, *_ = _random_edges(seed, nodes=15, edges=seed + 10)
+        graph = WinGraph.from_edges(src, dst)
+        adjacency = _adjacency(src, dst)
+        for source in graph.ids.tolist():
+            distance = _distances(adjacency, source)
+            for target in graph.ids.tolist():
+                path = graph.shortest_path(source, target)
+                if target not in distance:
+                    assert path is None
+                    continue
+                assert len(path) == distance[target] + 1
+                assert path[0] == source and path[-1] == target
+                assert all(b in adjacency[a] for a, b in zip(path, path[1:]))
+    assert graph.shortest_path(source, -1) is None
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('graph'))
+    graph = WinGraph.from_edges(*_random_edges(3, nodes=30, edges=80))
+    assert not WinGraph.is_current(path)
+    graph.save(path)
+    assert WinGraph.is_current(path)
+    loaded = WinGraph.load(path)
+    for name in ('ids', 'indptr', 'indices', 'component', 'rating'):
+        assert np.array_equal(getattr(loaded, name), getattr(graph, name))
+    ids = graph.ids.tolist()
+    for source, target in zip(ids, reversed(ids)):
+        assert loaded.shortest_path(source, target) == \
+            graph.shortest_path(source, target)
+    # pair counts are not a graph
+    _pair_counts(_random_games(1)).save(path)
+    assert not WinGraph.is_current(path)
+    with pytest.raises(ValueError):
+        WinGraph.load(path)
+
+
+def _simple_paths(adjacency, source, target, path=None):
+    path = path or [source]
+    if path[-1] == target:
+        yield path
+        return
+    for next_node in adjacency.get(path[-1], ()):
+        if next_node not in path:
+            yield from _simple_paths(adjacency, source, target,
+                                     path + [next_node])
+
+
+def test_strongest_paths():
+    for seed in range(15):
+        src, dst, contribution, rating = _random_edges(seed, nodes=8,
+                                                       edges=20)
+        graph = WinGraph.from_edges(src, dst, contribution, rating)
+        adjacency = _adjacency(src, dst)
+        for weight, values in (('rating', rating),
+                               ('contribution', contribution)):
+            cost = {(a, b): 1 / max(np.float32(w), 1)
+                    for a, b, w in zip(src, dst, values)}
+            for source, target in ((src[0], dst[-1]), (dst[0], src[-1])):
+                costs = sorted(sum(cost[hop] for hop in zip(p, p[1:]))
+                               for p in _simple_paths(adjacency, source,
+                                                      target))
+                paths = graph.strongest_paths(source, target, weight, k=4,
+                                              budget=10)
+                assert len(paths) == min(4, len(costs))
+                assert len(set(map(tuple, paths))) == len(paths)
+                for path, expected in zip(paths, costs):
+                    assert path[0] == source and path[-1] == target
+                    assert len(set(path)) == len(path)
+                    assert np.isclose(sum(cost[hop] for hop in
+                                          zip(path, path[1:])), expected)
+
+
+def test_strongest_paths_budget():
+    graph = WinGraph.from_edges(*_random_edges(5, nodes=30, edges=120))
+    source, target = graph.ids[0], graph.ids[-1]
+    shortest = graph.shortest_path(source, target)
+    # no time for a search, the shortest chain is returned
+    assert graph.strongest_paths(source, target, k=3, budget=-1) == \
+        ([shortest] if shortest else [])
+    assert graph.strongest_paths(source, source) == [[source]]
@@ -1,8 +1,14 @@
-from flask_admin import Admin
+import datetime
+
+from flask import request
+from flask_admin import Admin, BaseView, expose
 from flask_admin.contrib.sqla import ModelView
+from markupsafe import Markup, escape
 
 from models import (db, Player, City, Tournament, Translation, Topic,
-                    TopicIssue, RatingList)
+                    TopicIssue, RatingList, DagRun, JobRun)
+
+REGRESSION = 1.5  # last duration to median ratio marked as regression
 
 
 class IndexModelView(ModelView):
@@ -36,6 +42,56 @@ class TranslationView(ModelView):
     column_searchable_list = ('translated', 'id')
 
 
+def _timeline(view, context, model, name):
+    return Markup('<br>'.join(
+        escape(f'{step["name"]}: {step["status"]} '
+               f'{step.get("start", "")} - {step.get("end", "")} '
+               f'{step.get("error", "")}')
+        for step in model.timeline))
+
+
+class DagRunView(ModelView):
+    can_create = False
+    can_edit = False
+    column_list = ('name', 'status', 'started_at', 'duration', '_timeline')
+    column_labels = {'_timeline': 'Timeline'}
+    column_formatters = {'_timeline': _timeline}
+    column_default_sort = ('started_at', True)
+
+
+class JobRunView(ModelView):
+    can_create = False
+    can_edit = False
+    column_filters = ('name', 'status')
+    column_default_sort = ('started_at', True)
+
+
+class JobTrendsView(BaseView):
+    @expose('/')
+    def index(self):
+        days = request.args.get('days', 90, type=int)
+        since = datetime.datetime.now() - datetime.timedelta(days=days)
+        runs = {}
+        for run in JobRun.query.filter(JobRun.started_at >= since).order_by(
+                JobRun.started_at):
+            runs.setdefault(run.name, []).append(run)
+        trends = []
+        for name, task_runs in sorted(runs.items()):
+            durations = sorted(r.duration for r in task_runs)
+            median = durations[len(durations) // 2]
+            last = task_runs[-1]
+            trends.append({
+                'name': name,
+                'dates': [str(r.started_at)[:16] for r in task_runs],
+                'durations': [round(r.duration, 2) for r in task_runs],
+                'rows': [r.rows for r in task_runs],
+                'median': median,
+                'last': last,
+                'failed': sum(r.status == JobRun.FAILED for r in task_runs),
+                'regressed': last.duration > median * REGRESSION})
+        return self.render('admin/job_trends.html', trends=trends, days=days)
+
+
 index = PlayerView(Player, db.session, url='/admin')
 admin = Admin(name='ttennis.file admin', template_mode='bootstrap3',
               index_view=index)
@@ -46,3 +102,6 @@ admin.add_view(CityView(City, db.session))
 admin.add_view(ModelView(TopicIssue, db.session))
 admin.add_view(ModelView(Topic, db.session))
 admin.add_view(ModelView(Translation, db.session))
+admin.add_view(DagRunView(DagRun, db.session))
+admin.add_view(JobRunView(JobRun, db.session))
+admin.add_view(JobTrendsView(name='Job trends', endpoint='job_trends'))
@@ -1,9 +1,90 @@
-from flask import g
-from app import cache, translate_name
+from flask import g, request
+from sqlalchemy import func
+from app import app, cache, translate_name
 import models as m
 
+# cache namespaces, versions of their data are parts of cached pages keys,
+# so new data invalidates only pages of changed namespaces and old pages
+# age out by eviction
+UA = 'ua'  # current UA rating list with its updates
+UA_LIST = 'ua-list'  # id of the current UA rating list only
+WORLD = 'world'
 
-@cache.cached(key_prefix=lambda: g.lang + 'cities')
+# pages keyed by free query strings expire, so they don't fill the cache
+SEARCH_TIMEOUT = app.config.get('CACHE_SEARCH_TIMEOUT', 60 * 60)
+
+
+def player_namespace(id):
+    return f'player:{id}'
+
+
+def tournament_namespace(id):
+    return f'tournament:{id}'
+
+
+def _data_version(namespace):
+    kind, _, id = namespace.partition(':')
+    if kind in (UA, UA_LIST):
+        rating_list = get_current_rating_list()
+        if not rating_list or kind == UA_LIST:
+            return str(rating_list and rating_list.id)
+        updated_at = m.db.session.query(func.max(m.Rating.updated_at)).filter(
+            m.Rating.year == rating_list.year,
+            m.Rating.month == rating_list.month).scalar()
+        return f'{rating_list.id}/{updated_at}'
+    if kind == WORLD:
+        rating_list = m.WorldRatingList.query.order_by(
+            m.WorldRatingList.year.desc(),
+            m.WorldRatingList.month.desc()).first()
+        if not rating_list:
+            return 'None'
+        updated_at = m.db.session.query(
+            func.max(m.WorldRating.updated_at)).filter(
+            m.WorldRating.year == rating_list.year,
+            m.WorldRating.month == rating_list.month).scalar()
+        return f'{rating_list.id}/{updated_at}'
+    if kind == 'player':
+        return str(m.db.session.query(m.Player.updated_at).filter(
+            m.Player.id == id).scalar())
+    if kind == 'tournament':
+        return '{}/{}'.format(*m.db.session.query(
+            m.db.session.query(m.Tournament.updated_at).filter(
+                m.Tournament.id == id).as_scalar(),
+            m.db.session.query(func.count(m.Game.id)).filter(
+                m.Game.tournament_id == id).as_scalar()).one())
+    raise ValueError(f'Unknown cache namespace {namespace}')
+
+
+def cache_version(namespace):
+    """Version of namespace data, it is read from db once and cached."""
+    key = f'version:{namespace}'
+    version = cache.get(key)
+    if version is None:
+        version = _data_version(namespace)
+        cache.set(key, version)
+    return version
+
+
+def invalidate(*namespaces):
+    """Drops cached versions, so they are read from the new data."""
+    if namespaces:
+        cache.delete_many(*[f'version:{n}' for n in namespaces])
+
+
+def page_key(*namespaces):
+    """
+    `key_prefix` of cached pages: path with query, mobile flag and
+    versions of namespaces, so keys don't depend on host or scheme. A
+    namespace may be a function of view args.
+    """
+    def key():
+        versions = [cache_version(n(request.view_args) if callable(n) else n)
+                    for n in namespaces]
+        return f'{request.full_path}{request.MOBILE}:{"/".join(versions)}'
+    return key
+
+
+@cache.cached(key_prefix=lambda: g.lang + 'cities' + cache_version(UA))
 def cities():
     return {c.name: {'id': c.name, 'weight': c.weight,
                      'title': translate_name(c.name)}
@@ -15,13 +96,13 @@ def countries():
     return {c.code: c for c in m.Country.query.all()}
 
 
-@cache.cached(key_prefix='get_rating_lists')
+@cache.cached(key_prefix=lambda: 'get_rating_lists' + cache_version(UA_LIST))
 def get_rating_lists():
     return m.RatingList.query.order_by(m.RatingList.year.desc(),
                                        m.RatingList.month.desc()).all()
 
 
-@cache.cached(key_prefix='get_years')
+@cache.cached(key_prefix=lambda: 'get_years' + cache_version(UA_LIST))
 def get_years():
     return sorted(list(set([x.year for x in get_rating_lists()])))
 
@@ -1,11 +1,16 @@
 import json
-from flask import abort, g, request, url_for, Blueprint
+from flask import abort, current_app, g, request, url_for, Blueprint
 from sqlalchemy.orm import eagerload
-from services.games_chain import find_chain
+from services.games_chain import (chain_games, find_chain,
+                                  find_strongest_chains)
+from services.win_graph import WEIGHTS
 import models as m
-from app import cache, render_template, month_abbr
+from app import cache, render_template, month_abbr, translate_names
 from services.translator import search_translations
-from views.common import cities, get_rating_lists, get_years, translate_name
+from views.common import (SEARCH_TIMEOUT, UA, UA_LIST, cities,
+                          get_rating_lists, get_years, page_key,
+                          player_namespace, tournament_namespace,
+                          translate_name)
 from flask_mobility.decorators import mobile_template
 
 bp = Blueprint('rating', __name__)
@@ -14,7 +19,7 @@ bp = Blueprint('rating', __name__)
 @bp.route('/rating/<category>/')
 @bp.route('/rating/')
 @mobile_template('{mobile/}rating/rating.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(UA))
 def rating(template, category='MEN'):
     rating_lists = get_rating_lists()
     year = request.args.get('year', rating_lists[0].year, type=int)
@@ -46,7 +51,8 @@ def rating(template, category='MEN'):
 
 @bp.route('/player/<id>/')
 @mobile_template('{mobile/}rating/player.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(
+    UA_LIST, lambda args: player_namespace(args['id'])))
 def player(template, id):
     player = m.Player.query.get(id)
     if not player:
@@ -65,7 +71,8 @@ def player(template, id):
 
 @bp.route('/player-tournament/<int:player_id>/<int:tournament_id>/')
 @mobile_template('{mobile/}rating/player_tournament.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(
+    lambda args: tournament_namespace(args['tournament_id'])))
 def player_tournament(template, player_id, tournament_id):
     player_tournament = m.PlayerTournament.query.filter_by(
         player_id=player_id, tournament_id=tournament_id).first()
@@ -74,7 +81,8 @@ def player_tournament(template, player_id, tournament_id):
 
 @bp.route('/tournament/<int:id>/')
 @mobile_template('{mobile/}rating/tournament.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(
+    lambda args: tournament_namespace(args['id'])))
 def tournament(template, id):
     tournament = m.Tournament.query.get(id)
     return render_template(template, tournament=tournament)
@@ -83,7 +91,7 @@ def tournament(template, id):
 @bp.route('/tournaments/<int:year>/<int:month>/')
 @bp.route('/tournaments/')
 @mobile_template('{mobile/}rating/tournaments.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(UA))
 def tournaments(template, year=None, month=None):
     years = get_years()
     if not year:
@@ -103,26 +111,51 @@ def tournaments(template, year=None, month=None):
 
 @bp.route('/win-chain/')
 @mobile_template('{mobile/}rating/win_chain.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(timeout=SEARCH_TIMEOUT, key_prefix=page_key(UA))
 def win_chain(template):
     player1_id = request.args.get('player1_id', type=int)
     player2_id = request.args.get('player2_id', type=int)
     count_all = request.args.get('count_all', type=bool, default=False)
+    # 'shortest' or 'strongest' chain weighted by one of `WEIGHTS`
+    mode = request.args.get('mode', 'shortest')
+    weight = request.args.get('weight', 'rating')
+    if weight not in WEIGHTS:
+        weight = 'rating'
+    k = request.args.get('k', 3, type=int)
+    k = max(1, min(k, current_app.config.get('WIN_CHAIN_MAX_K', 5)))
 
     chain = []
+    alternatives = []
+    hops = []
+    names = {}
     player1 = None
     player2 = None
     if player1_id and player2_id:
         player1 = m.Player.query.get(player1_id)
         player2 = m.Player.query.get(player2_id)
-        chain = find_chain(player1_id, player2_id, all=count_all)
+        if mode == 'strongest':
+            chains = find_strongest_chains(player1_id, player2_id,
+                                           all=count_all, weight=weight,
+                                           k=k)
+            chain = chains[0] if chains else None
+            alternatives = chains[1:]
+        else:
+            chain = find_chain(player1_id, player2_id, all=count_all)
+        if chain:
+            hops = chain_games(chain, all=count_all)
+            names = translate_names(
+                [p.name for c in [chain] + alternatives for p in c] +
+                [game.tournament.name for games in hops for game in games
+                 if game.tournament])
     return render_template(template, player1=player1, player2=player2,
-                           chain=chain, count_all=count_all)
+                           chain=chain, alternatives=alternatives, hops=hops,
+                           names=names, count_all=count_all, mode=mode,
+                           weight=weight, k=k)
 
 
 @bp.route('/games/')
 @mobile_template('{mobile/}rating/games_search.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(timeout=SEARCH_TIMEOUT, key_prefix=page_key(UA))
 def game_search(template):
     player1 = request.args.get('player1', '')
     player2 = request.args.get('player2', '')
@@ -149,7 +182,7 @@ def game_search(template):
 
 @bp.route('/statistics/')
 @mobile_template('{mobile/}rating/statistics.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(UA))
 def statistics(template):
     page = request.args.get('page', 1, type=int)
     issues = m.TopicIssue.query.join(m.Topic).options(
@@ -159,7 +192,7 @@ def statistics(template):
 
 
 @bp.route('/player-search/<name>')
-@cache.cached()
+@cache.cached(timeout=SEARCH_TIMEOUT, key_prefix=page_key(UA))
 def player_search(name):
     if g.lang == 'ru':  # default player name language
         matches = m.Player.query.filter(
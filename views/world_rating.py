@@ -3,7 +3,8 @@ from flask import abort, request, url_for, Blueprint
 from sqlalchemy.orm import eagerload
 import models as m
 from app import cache, render_template, month_abbr
-from views.common import countries, translate_name
+from views.common import (SEARCH_TIMEOUT, WORLD, countries, page_key,
+                          translate_name)
 from flask_mobility.decorators import mobile_template
 
 bp = Blueprint('world_rating', __name__)
@@ -12,7 +13,7 @@ bp = Blueprint('world_rating', __name__)
 @bp.route('/world-rating/<category>/')
 @bp.route('/world-rating/')
 @mobile_template('{mobile/}world_rating/world-rating.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(WORLD))
 def rating(template, category='MEN'):
     rating_lists = m.WorldRatingList.query.order_by(
         m.WorldRatingList.year.desc(),
@@ -47,7 +48,7 @@ def rating(template, category='MEN'):
 
 @bp.route("/world-player/<id>/")
 @mobile_template('{mobile/}world_rating/world-player.html')
-@cache.cached(key_prefix=lambda: request.url + str(request.MOBILE))
+@cache.cached(key_prefix=page_key(WORLD))
 def player(template, id):
     player = m.WorldPlayer.query.get(id)
     if not player:
@@ -63,7 +64,7 @@ def player(template, id):
 
 
 @bp.route("/world-player-search/<name>/")
-@cache.cached()
+@cache.cached(timeout=SEARCH_TIMEOUT, key_prefix=page_key(WORLD))
 def player_search(name):
     matches = m.WorldPlayer.query.filter(m.WorldPlayer.name.like(
         '%' + name.title() + '%')).limit(10).all()